@@ -45,7 +45,7 @@ setup(name='tabdoc',
                         'aelog>=1.0.3',
                         'reportlab<=3.5.68',
                         'openpyxl>=2.4.11,<=3.1.5'],
-      python_requires=">=3.6",
+      python_requires=">=3.7",
       keywords="tabular,datasets,excel,word,pdf",
       license='MIT',
       classifiers=[
@@ -59,7 +59,6 @@ setup(name='tabdoc',
           'Topic :: Software Development :: Libraries :: Python Modules',
           'Topic :: Utilities',
           'Programming Language :: Python',
-          'Programming Language :: Python :: 3.6',
           'Programming Language :: Python :: 3.7',
           'Programming Language :: Python :: 3.8',
           'Programming Language :: Python :: 3.9']
@@ -6,9 +6,32 @@
 @software: PyCharm
 @time: 19-3-20 下午6:29
 """
+from importlib import import_module
 
-__version__ = "1.0.9"
+__version__ = "1.1.0"
 
-from .tabexcel import *
-from .tabpdf import *
-from .tabword import *
+__all__ = ("ExcelWriter", "ExcelStyleCache", "PDFWriter", "register_font", "register_style", "WordWriter", "ValueAttr")
+
+# 各个writer的依赖比较重(reportlab会加载字体，python-docx、openpyxl等)，第一次使用时才导入对应的模块
+_LAZY_ATTRS = {
+    "ExcelWriter": ".tabexcel",
+    "ExcelStyleCache": ".tabexcel",
+    "PDFWriter": ".tabpdf",
+    "register_font": ".tabpdf",
+    "register_style": ".tabpdf",
+    "WordWriter": ".tabword",
+    "ValueAttr": ".tabword",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value  # 后续访问不再经过__getattr__
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *__all__})
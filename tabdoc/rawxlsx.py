@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 26-10-18 下午2:36
+"""
+import re
+import zipfile
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from math import isfinite
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from openpyxl.cell.cell import get_time_format
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE, BUILTIN_FORMATS_REVERSE
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+from .utils import MergedRanges
+
+__all__ = ("UnsupportedFeature", "SharedStrings", "CellStyles", "render_sheet", "render_sheet_part", "write_workbook")
+
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# XML中不允许出现的控制字符，openpyxl遇到时会报错，这里交给openpyxl处理
+_ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+# 单元格最多32767个字符，和openpyxl一样进行截断
+_MAX_STRING_LENGTH = 32767
+_DATETIME_TYPES = (datetime, date, time, timedelta)
+_COLOR_RE = re.compile(r"^([A-Fa-f0-9]{2})?[A-Fa-f0-9]{6}$")
+# 默认的单元格样式的键，填充样式表中空出的索引
+_DEFAULT_STYLE_KEY = (None, None, None, False, None)
+# 工作表名称中不允许出现的字符
+_INVALID_TITLE_RE = re.compile(r"[\\*?:/\[\]]")
+
+_CONTENT_TYPES_HEAD = (
+    _XML_HEADER +
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>')
+_SHEET_CONTENT_TYPE = ('<Override PartName="/xl/worksheets/sheet{0}.xml" '
+                       'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>')
+_ROOT_RELS = (
+    _XML_HEADER + f'<Relationships xmlns="{_PKG_REL_NS}">'
+                  f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+                  '</Relationships>')
+_FROZEN_VIEW = ('<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                '<selection pane="bottomLeft" activeCell="A2" sqref="A2"/>')
+_THIN_BORDER = ('<border><left style="thin"><color rgb="00000000"/></left>'
+                '<right style="thin"><color rgb="00000000"/></right>'
+                '<top style="thin"><color rgb="00000000"/></top>'
+                '<bottom style="thin"><color rgb="00000000"/></bottom><diagonal/></border>')
+
+
+class UnsupportedFeature(Exception):
+    """
+    工作表中使用了本引擎不支持的特性，需要回退到openpyxl生成
+    """
+    pass
+
+
+class StyleLimitReached(Exception):
+    """
+    子进程中工作表的样式数量超过了预先分配的索引范围
+    """
+    pass
+
+
+class SharedStrings(object):
+    """
+    共享字符串表
+    """
+
+    def __init__(self, ):
+        """
+            共享字符串表
+        """
+        self.index = {}
+        self.strings: List[str] = []
+
+    def add(self, value: str) -> int:
+        """
+        添加字符串，返回字符串在共享字符串表中的索引
+        Args:
+            value: 字符串
+        Returns:
+
+        """
+        idx = self.index.get(value)
+        if idx is None:
+            if len(value) > _MAX_STRING_LENGTH:
+                return self.add(value[:_MAX_STRING_LENGTH])
+            if _ILLEGAL_CHARACTERS_RE.search(value):
+                raise UnsupportedFeature("illegal characters")
+            idx = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return idx
+
+    def to_xml(self, ) -> bytes:
+        """
+        生成sharedStrings.xml
+        Returns:
+
+        """
+        parts = [_XML_HEADER, f'<sst xmlns="{_MAIN_NS}" count="{len(self.strings)}" '
+                              f'uniqueCount="{len(self.strings)}">']
+        for value in self.strings:
+            if value[:1].isspace() or value[-1:].isspace():
+                parts.append(f'<si><t xml:space="preserve">{escape(value)}</t></si>')
+            else:
+                parts.append(f'<si><t>{escape(value)}</t></si>')
+        parts.append('</sst>')
+        return "".join(parts).encode("utf-8")
+
+
+class CellStyles(object):
+    """
+    单元格样式表
+
+    样式的键为(color, horizontal, vertical, bold, number_format)，和ExcelStyleCache一致，
+    每种样式的xf片段只生成一次。子进程中生成工作表时每个工作表使用预先分配的索引范围，
+    主进程按顺序放到工作簿的样式表中，工作表中的索引不需要替换
+    """
+
+    def __init__(self, start: int = 1, limit: Optional[int] = None):
+        """
+            单元格样式表
+        Args:
+            start: 第一个样式的索引，0为默认样式
+            limit: 样式的最大数量，None为不限制
+        """
+        self.index = {}
+        self.keys: List[tuple] = []
+        self.start = start
+        self.limit = limit
+
+    def get(self, key: tuple) -> int:
+        """
+        获取样式在cellXfs中的索引，0为默认样式
+        Args:
+            key: 样式的键
+        Returns:
+
+        """
+        idx = self.index.get(key)
+        if idx is None:
+            if key[0] and not _COLOR_RE.match(key[0]):
+                raise UnsupportedFeature("color")
+            if self.limit is not None and len(self.keys) >= self.limit:
+                raise StyleLimitReached()
+            idx = self.index[key] = self.start + len(self.keys)
+            self.keys.append(key)
+        return idx
+
+    def place(self, start: int, keys: List[tuple]):
+        """
+        把子进程中从start开始编号的样式放到样式表中，前面空出的索引使用默认样式，
+        需要按start从小到大的顺序放置
+        Args:
+            start: 子进程中第一个样式的索引
+            keys: 子进程中的样式的键
+        Returns:
+
+        """
+        if start < self.start + len(self.keys):
+            raise ValueError(f"样式的索引{start}已经被占用")
+        self.keys.extend([_DEFAULT_STYLE_KEY] * (start - self.start - len(self.keys)))
+        self.keys.extend(keys)
+
+    def to_xml(self, ) -> bytes:
+        """
+        生成styles.xml
+        Returns:
+
+        """
+        fills, num_fmts, xfs = {}, {}, []
+        for color, horizontal, vertical, bold, number_format in self.keys:
+            fill_id = 0
+            if color:
+                fill_id = fills.setdefault(color, len(fills) + 2)
+            num_fmt_id = 0
+            if number_format:
+                num_fmt_id = BUILTIN_FORMATS_REVERSE.get(number_format)
+                if num_fmt_id is None:
+                    num_fmt_id = num_fmts.setdefault(number_format, len(num_fmts) + BUILTIN_FORMATS_MAX_SIZE)
+            alignment = '<alignment'
+            if horizontal:
+                alignment += f' horizontal="{horizontal}"'
+            if vertical:
+                alignment += f' vertical="{vertical}"'
+            alignment += ' wrapText="1"/>'
+            xfs.append(f'<xf numFmtId="{num_fmt_id}" fontId="{1 if bold else 0}" fillId="{fill_id}" borderId="1" '
+                       f'xfId="0" applyNumberFormat="{1 if num_fmt_id else 0}" applyFont="{1 if bold else 0}" '
+                       f'applyFill="{1 if fill_id else 0}" applyBorder="1" applyAlignment="1">{alignment}</xf>')
+
+        parts = [_XML_HEADER, f'<styleSheet xmlns="{_MAIN_NS}">']
+        if num_fmts:
+            parts.append(f'<numFmts count="{len(num_fmts)}">')
+            parts.extend(f'<numFmt numFmtId="{num_fmt_id}" formatCode={quoteattr(number_format)}/>'
+                         for number_format, num_fmt_id in num_fmts.items())
+            parts.append('</numFmts>')
+        parts.append('<fonts count="2"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+                     '<font><b val="1"/></font></fonts>')
+        parts.append(f'<fills count="{len(fills) + 2}"><fill><patternFill/></fill>'
+                     '<fill><patternFill patternType="gray125"/></fill>')
+        parts.extend(f'<fill><patternFill patternType="solid"><fgColor rgb="{_argb(color)}"/></patternFill></fill>'
+                     for color in fills)
+        parts.append('</fills>')
+        parts.append(f'<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+                     f'{_THIN_BORDER}</borders>')
+        parts.append('<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>')
+        parts.append(f'<cellXfs count="{len(xfs) + 1}"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>')
+        parts.extend(xfs)
+        parts.append('</cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+                     '</styleSheet>')
+        return "".join(parts).encode("utf-8")
+
+
+def _argb(color: str) -> str:
+    """
+    转换为ARGB格式的颜色，和openpyxl保持一致
+    Args:
+        color: RGB或者ARGB颜色
+    Returns:
+
+    """
+    return f"00{color}" if len(color) == 6 else color
+
+
+def _inline_string(value: str) -> str:
+    """
+    生成内联字符串的XML，和SharedStrings中一样截断和检查字符
+    Args:
+        value: 字符串
+    Returns:
+
+    """
+    value = value[:_MAX_STRING_LENGTH]
+    if _ILLEGAL_CHARACTERS_RE.search(value):
+        raise UnsupportedFeature("illegal characters")
+    if value[:1].isspace() or value[-1:].isspace():
+        return f'<is><t xml:space="preserve">{escape(value)}</t></is>'
+    return f'<is><t>{escape(value)}</t></is>'
+
+
+def render_sheet(rows: Iterable[Sequence], write: Callable[[bytes], None], *, shared_strings: Optional[SharedStrings],
+                 cell_styles: CellStyles, parse_cell: Callable, has_header: bool = True, freeze_panes: bool = True,
+                 merge_cells: Optional[Iterable[Sequence[int]]] = None, native_types: bool = False,
+                 tab_selected: bool = False):
+    """
+    生成工作表的XML，按行写入，不需要缓存整个工作表的XML
+    Args:
+        rows: 工作表的行数据，包括表头
+        write: 写入XML的函数
+        shared_strings: 共享字符串表，None时使用内联字符串，不需要在工作表之间共享
+        cell_styles: 单元格样式表
+        parse_cell: 解析单元格值和样式的函数，同ExcelWriter._parse_cell
+        has_header: 第一行是否为表头，表头会加粗
+        freeze_panes: 是否冻结首行
+        merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始，
+            也可以是MergedRanges
+        native_types: 是否为原生类型的单元格设置数字格式
+        tab_selected: 是否为选中的工作表
+    Returns:
+
+    """
+    if not isinstance(merge_cells, MergedRanges):
+        merge_cells = MergedRanges(merge_cells)
+    merge_anchors, covered_cells = merge_cells.anchors, merge_cells.covered_cells
+    sheet_view = '<sheetView tabSelected="1" workbookViewId="0">' if tab_selected else '<sheetView workbookViewId="0">'
+    if freeze_panes and has_header:
+        sheet_view += _FROZEN_VIEW
+    write(f'{_XML_HEADER}<worksheet xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><sheetViews>{sheet_view}</sheetView>'
+          f'</sheetViews><sheetFormatPr baseColWidth="8" defaultRowHeight="15"/><sheetData>'.encode("utf-8"))
+
+    columns: List[str] = []
+    get_style = cell_styles.get
+    add_string = shared_strings.add if shared_strings is not None else None
+    # 内联字符串的XML片段，每个字符串只生成一次
+    inline_strings = {}
+    # 每种样式的属性片段只生成一次
+    style_attrs = {}
+    covered_attr = f' s="{get_style((None, None, None, False, None))}"' if covered_cells else ""
+    buffer = []
+    for row_number, row in enumerate(rows, 1):
+        is_bold = has_header and row_number == 1
+        if len(row) > len(columns):
+            columns.extend(get_column_letter(idx) for idx in range(len(columns) + 1, len(row) + 1))
+        cells = [f'<row r="{row_number}">']
+        covered = covered_cells.get(row_number, ())
+        for column_number, row_cell_value in enumerate(row, 1):
+            if column_number in covered:
+                # 被合并的单元格不需要值，只保留边框
+                cells.append(f'<c r="{columns[column_number - 1]}{row_number}"{covered_attr}/>')
+                continue
+            value, color, horizontal, vertical, number_format = parse_cell(row_cell_value, native_types)
+            if number_format is None and isinstance(value, _DATETIME_TYPES):
+                # 和openpyxl一样为没有数字格式的日期时间设置默认的格式，否则只显示序列号
+                number_format = get_time_format(type(value))
+            if (row_number, column_number) in merge_anchors:
+                horizontal, vertical = "center", "center"
+            style_key = (color, horizontal, vertical, is_bold, number_format)
+            style_attr = style_attrs.get(style_key)
+            if style_attr is None:
+                style_attr = style_attrs[style_key] = f' s="{get_style(style_key)}"'
+            ref = f'{columns[column_number - 1]}{row_number}'
+            value_type = type(value)
+            if value_type is str:
+                if not value:
+                    cells.append(f'<c r="{ref}"{style_attr}/>')
+                elif value[0] == "=" and len(value) > 1:
+                    # 公式交给openpyxl处理
+                    raise UnsupportedFeature("formula")
+                elif add_string is not None:
+                    cells.append(f'<c r="{ref}"{style_attr} t="s"><v>{add_string(value)}</v></c>')
+                else:
+                    fragment = inline_strings.get(value)
+                    if fragment is None:
+                        fragment = inline_strings[value] = _inline_string(value)
+                    cells.append(f'<c r="{ref}"{style_attr} t="inlineStr">{fragment}</c>')
+            elif value_type is int:
+                cells.append(f'<c r="{ref}"{style_attr} t="n"><v>{value}</v></c>')
+            elif value_type is float or value_type is Decimal:
+                if not isfinite(value):
+                    raise UnsupportedFeature("nan or inf")
+                cells.append(f'<c r="{ref}"{style_attr} t="n"><v>{value!r}</v></c>' if value_type is float else
+                             f'<c r="{ref}"{style_attr} t="n"><v>{value}</v></c>')
+            elif value_type is bool:
+                cells.append(f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>')
+            elif value is None:
+                cells.append(f'<c r="{ref}"{style_attr}/>')
+            elif isinstance(value, _DATETIME_TYPES) and getattr(value, "tzinfo", None) is None:
+                serial = to_excel(value)
+                if serial is None or serial < 0:
+                    raise UnsupportedFeature("datetime")
+                cells.append(f'<c r="{ref}"{style_attr} t="n"><v>{serial!r}</v></c>')
+            else:
+                raise UnsupportedFeature(f"value type {value_type}")
+        cells.append('</row>')
+        buffer.append("".join(cells))
+        if len(buffer) >= 1000:
+            write("".join(buffer).encode("utf-8"))
+            buffer.clear()
+    if buffer:
+        write("".join(buffer).encode("utf-8"))
+
+    tail = ['</sheetData>']
+    if merge_cells:
+        tail.append(f'<mergeCells count="{len(merge_cells)}">')
+        for start_row, start_column, end_row, end_column in merge_cells:
+            tail.append(f'<mergeCell ref="{get_column_letter(start_column)}{start_row}:'
+                        f'{get_column_letter(end_column)}{end_row}"/>')
+        tail.append('</mergeCells>')
+    tail.append('<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/></worksheet>')
+    write("".join(tail).encode("utf-8"))
+
+
+def write_workbook(archive: zipfile.ZipFile, sheet_titles: Sequence[str], shared_strings: SharedStrings,
+                   cell_styles: CellStyles):
+    """
+    写入工作簿中除工作表之外的部分，工作表需要事先写入xl/worksheets/sheetN.xml
+    Args:
+        archive: 工作簿的zip文件
+        sheet_titles: 工作表的名称，和工作表的顺序一致
+        shared_strings: 共享字符串表
+        cell_styles: 单元格样式表
+    Returns:
+
+    """
+    sheet_count = len(sheet_titles)
+    if not sheet_count or len({title.lower() for title in sheet_titles}) != sheet_count:
+        raise UnsupportedFeature("duplicate sheet title")
+    for title in sheet_titles:
+        if not title or len(title) > 31 or _INVALID_TITLE_RE.search(title):
+            raise UnsupportedFeature("sheet title")
+    archive.writestr("[Content_Types].xml", "".join(
+        [_CONTENT_TYPES_HEAD, *[_SHEET_CONTENT_TYPE.format(idx) for idx in range(1, sheet_count + 1)], '</Types>']))
+    archive.writestr("_rels/.rels", _ROOT_RELS)
+
+    sheets = "".join(f'<sheet name={quoteattr(title)} sheetId="{idx}" r:id="rId{idx}"/>'
+                     for idx, title in enumerate(sheet_titles, 1))
+    archive.writestr("xl/workbook.xml", f'{_XML_HEADER}<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}">'
+                                        f'<bookViews><workbookView activeTab="0"/></bookViews>'
+                                        f'<sheets>{sheets}</sheets></workbook>')
+    rels = [f'<Relationship Id="rId{idx}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{idx}.xml"/>'
+            for idx in range(1, sheet_count + 1)]
+    rels.append(f'<Relationship Id="rId{sheet_count + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>')
+    rels.append(f'<Relationship Id="rId{sheet_count + 2}" Type="{_REL_NS}/sharedStrings" Target="sharedStrings.xml"/>')
+    archive.writestr("xl/_rels/workbook.xml.rels",
+                     f'{_XML_HEADER}<Relationships xmlns="{_PKG_REL_NS}">{"".join(rels)}</Relationships>')
+    archive.writestr("xl/styles.xml", cell_styles.to_xml())
+    archive.writestr("xl/sharedStrings.xml", shared_strings.to_xml())
+
+
+def render_sheet_part(rows: Iterable[Sequence], options: dict, style_start: int,
+                      style_limit: int) -> Optional[Tuple[bytes, List[tuple]]]:
+    """
+    在子进程中生成工作表的XML
+
+    字符串使用内联字符串，样式使用从style_start开始的索引，主进程只需要放置样式并写入XML
+    Args:
+        rows: 工作表的行数据，包括表头
+        options: render_sheet的其他参数
+        style_start: 第一个样式的索引
+        style_limit: 样式的最大数量
+    Returns:
+        (工作表的XML, 样式表的键)，样式数量超过style_limit时为None
+    """
+    cell_styles, parts = CellStyles(style_start, style_limit), []
+    try:
+        render_sheet(rows, parts.append, shared_strings=None, cell_styles=cell_styles, **options)
+    except StyleLimitReached:
+        return None
+    return b"".join(parts), cell_styles.keys
@@ -6,36 +6,124 @@
 @software: PyCharm
 @time: 19-2-11 下午6:14
 """
+import zipfile
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
 from io import BytesIO
-from typing import MutableMapping, Sequence, Union
+from itertools import chain, count, islice, repeat
+from typing import Iterable, Union
 
 import tablib
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
-from openpyxl.utils import get_column_letter
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE, BUILTIN_FORMATS_REVERSE
+from openpyxl.worksheet.cell_range import CellRange
 from path import Path
 
-__all__ = ("ExcelWriter",)
+from .utils import MergedRanges, RowNormalizer, split_frame, split_header
+
+__all__ = ("ExcelWriter", "ExcelStyleCache")
+
+# 原生类型单元格的数字格式，按值的类型缓存
+_NUMBER_FORMATS = {datetime: "yyyy-mm-dd hh:mm:ss", date: "yyyy-mm-dd", time: "hh:mm:ss", timedelta: "[hh]:mm:ss"}
+# 多进程导出时每个工作表预先分配的样式索引的数量，以及Excel中单元格样式的最大数量
+STYLE_BLOCK_SIZE = 256
+MAX_CELL_STYLES = 64000
+
+
+class ExcelStyleCache(object):
+    """
+    单元格样式缓存
+
+    每种颜色、对齐方式、边框和加粗的组合只在工作簿中注册一次，单元格通过引用样式索引来设置样式，
+    避免每个单元格都创建Alignment、Border等对象，同时也减小了styles.xml的大小
+    """
+
+    def __init__(self, workbook: Workbook):
+        """
+            单元格样式缓存
+        Args:
+            workbook: 样式所属的工作簿
+        """
+        self.workbook = workbook
+        self._styles = {}
+        thin = Side(border_style="thin", color="000000")
+        # 增加边框单线，这里是固定的
+        # noinspection PyProtectedMember
+        self._border_id = workbook._borders.add(Border(top=thin, left=thin, right=thin, bottom=thin))
+        # noinspection PyProtectedMember
+        self._bold_font_id = workbook._fonts.add(Font(bold=True))
+
+    # noinspection PyProtectedMember
+    def get(self, color: str = None, horizontal: str = None, vertical: str = None, bold: bool = False,
+            number_format: str = None) -> StyleArray:
+        """
+        获取样式，不存在时创建并缓存
+        Args:
+            color: 背景颜色
+            horizontal: 水平对齐方式
+            vertical: 垂直对齐方式
+            bold: 是否加粗
+            number_format: 数字格式
+        Returns:
+            样式索引数组，赋值给单元格时需要复制
+        """
+        key = (color, horizontal, vertical, bold, number_format)
+        style = self._styles.get(key)
+        if style is None:
+            style = StyleArray()
+            style.borderId = self._border_id
+            style.alignmentId = self.workbook._alignments.add(
+                Alignment(wrap_text=True, horizontal=horizontal, vertical=vertical))
+            if color:
+                style.fillId = self.workbook._fills.add(PatternFill("solid", fgColor=color))
+            if bold:
+                style.fontId = self._bold_font_id
+            if number_format:
+                if number_format in BUILTIN_FORMATS_REVERSE:
+                    style.numFmtId = BUILTIN_FORMATS_REVERSE[number_format]
+                else:
+                    style.numFmtId = self.workbook._number_formats.add(number_format) + BUILTIN_FORMATS_MAX_SIZE
+            self._styles[key] = style
+        return style
 
 
 class ExcelWriter(object):
     """
     excel book writer
     """
+    # Excel工作表的最大行数和最大列数，超过最大行数时拆分到续表中
+    max_sheet_rows = 1048576
+    max_sheet_columns = 16384
 
-    def __init__(self, excel_name, excel_path=None):
+    def __init__(self, excel_name, excel_path=None, *, streaming=False, freeze_panes=True, native_types=False,
+                 workers=None):
         """
             excel book writer
         Args:
             excel_path: excel path
             excel_name: excel 名称
+            streaming: 是否为流式写入模式，流式模式下数据直接写入openpyxl的只写工作表，不再缓存到tablib中
+            freeze_panes: 流式写入模式下是否冻结首行，非流式模式下以export_book的参数为准
+            native_types: 是否把日期时间和Decimal导出为Excel原生的单元格并设置数字格式，默认会把日期时间转换为字符串
+            workers: 导出时并行生成工作表的进程数，默认在当前进程中逐个生成
         """
         self.excel_path = excel_path
         self.excel_name = f"{excel_name}.xlsx"
-        self.excel_book = tablib.Databook()
+        self.streaming = streaming
+        self.native_types = native_types
+        self.workers = workers
+        self.freeze_panes = freeze_panes
+        # 流式模式下直接使用只写的工作簿，每一行添加后就会写入临时文件，内存占用不随行数增长
+        self.excel_book = Workbook(write_only=True) if streaming else tablib.Databook()
         self.merge_cells_index = {}
         self.sheet_names = Counter()  # 多个sheet name的映射，防止名称重复造成错误
+        self._stream_style_cache = None
 
     def __enter__(self):
         """
@@ -57,148 +145,423 @@ class ExcelWriter(object):
         """
         self.save()
 
-    # noinspection DuplicatedCode
-    @staticmethod
-    def _reduce_datetimes(row):
-        """Receives a row, converts datetimes to strings."""
+    def add_sheet(self, sheet_name, sheet_data: Iterable, merge_cells=None):
+        """
+        为excel添加工作表
+        Args:
+            sheet_name: 工作表的名称
+            sheet_data: 工作表的数据， 可以是列表、生成器或者数据库游标，每行是元祖、列表或者字典（从records查询出来的数据库的数据）
+            merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始
+        Returns:
+
+        """
+        # 原生类型模式下不在python中格式化日期时间，由单元格的数字格式控制显示
+        reduce_row = None if self.native_types else RowNormalizer()
+        # 只预读第一行作为表头，表体逐行补齐长度并转换时间类型
+        headers, rows = split_header(sheet_data, [{}], reduce_row, "sheet_data值数据类型错误,请检查")
+        self._add_sheet_rows(sheet_name, headers, rows, merge_cells)
 
-        row = list(row)
+    def add_sheet_frame(self, sheet_name, frame, merge_cells=None):
+        """
+        为excel添加列式数据的工作表
+        Args:
+            sheet_name: 工作表的名称
+            frame: 工作表的数据，pandas.DataFrame、numpy结构化数组或者pyarrow.Table
+            merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始
+        Returns:
 
-        for i, val in enumerate(row):
-            if hasattr(val, "strftime"):
-                row[i] = val.strftime("%Y-%m-%d %H:%M:%S")
-            elif hasattr(val, "isoformat"):
-                row[i] = val.isoformat()
-        return tuple(row)
+        """
+        # 按列向量化处理时间和空值，表体不需要再逐行处理
+        headers, rows = split_frame(frame, reduce_datetimes=not self.native_types)
+        self._add_sheet_rows(sheet_name, headers, rows, merge_cells)
 
-    def add_sheet(self, sheet_name, sheet_data: list, merge_cells=None):
+    def _add_sheet_rows(self, sheet_name, headers, rows, merge_cells=None):
         """
-        为excel添加工作表
+        添加已经处理好的表头和表体数据
         Args:
             sheet_name: 工作表的名称
-            sheet_data: 工作表的数据， 必须是列表中嵌套元祖、列表或者字典（从records查询出来的数据库的数据）
+            headers: 表头
+            rows: 表体数据的迭代器
             merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始
         Returns:
 
         """
-        sheet_data = sheet_data if sheet_data else [{}]
+        if len(headers) > self.max_sheet_columns:
+            raise ValueError(f"列数超过了Excel的最大列数{self.max_sheet_columns}")
+        # 添加时检查合并区域的边界和重叠，merge_cells_index中保存的是原来的合并单元格的索引
+        merge_ranges = MergedRanges(merge_cells, max_column=self.max_sheet_columns,
+                                    error_msg=f"merge_cells值错误,最小值为1,最大列数为{self.max_sheet_columns}")
+
+        # 超过Excel最大行数的数据拆分到续表中，续表重复表头，名称按照重复名称的规则生成
+        header_rows = 1 if headers else 0
+        shard_rows = self.max_sheet_rows - header_rows
+        rows = iter(rows)
+        for shard in count():
+            if shard == 0:
+                shard_data = islice(rows, shard_rows)
+            else:
+                first_row = next(rows, None)
+                if first_row is None:
+                    break
+                shard_data = chain((first_row,), islice(rows, shard_rows - 1))
+            title = self._sheet_title(sheet_name)
+            shard_merge_cells = self._shard_merge_cells(merge_cells, merge_ranges, shard, shard_rows, header_rows)
+            if shard_merge_cells:
+                self.merge_cells_index[title] = shard_merge_cells
+
+            if self.streaming:
+                self.stream_sheet(title, headers, shard_data, shard_merge_cells)
+            else:
+                excel_sheet = tablib.Dataset(title=title)
+                excel_sheet.headers = headers
+                for row in shard_data:
+                    excel_sheet.append(row)
+                self.excel_book.add_sheet(excel_sheet)
+
+    def _sheet_title(self, sheet_name):
+        """
+        生成不重复的工作表名称
+        Args:
+            sheet_name: 工作表的名称
+        Returns:
+
+        """
         #  处理sheet name可能出现重复的情况
         self.sheet_names[sheet_name] += 1
-        sheet_name = sheet_name if self.sheet_names[sheet_name] == 1 else f"{sheet_name}{self.sheet_names[sheet_name]}"
-
-        excel_sheet = tablib.Dataset(title=sheet_name)
-
-        for row in sheet_data:
-            if not isinstance(row, (MutableMapping, Sequence)):
-                raise ValueError("sheet_data值数据类型错误,请检查")
-
-        # 处理list或者tuple个别长度不一致的情况
-        first = sheet_data[0]
-        if isinstance(first, Sequence):
-            for index, row in enumerate(sheet_data[1:], 1):
-                diff = len(row) - len(first)
-                if abs(diff) > 0:
-                    if isinstance(row, list):
-                        row.extend(["" for _ in range(diff)])
-                    else:
-                        sheet_data[index] = (*row, *["" for _ in range(diff)])
-
-        if isinstance(first, MutableMapping):
-            excel_sheet.headers = list(first.keys())
-            for row in sheet_data:
-                row = self._reduce_datetimes(row.values())
-                excel_sheet.append(row)
-        else:
-            excel_sheet.headers = first
-            for row in sheet_data[1:]:
-                row = self._reduce_datetimes(row)
-                excel_sheet.append(row)
-
-        self.excel_book.add_sheet(excel_sheet)
-        if merge_cells:
-            verify_cells_index = []
-            for val in merge_cells:
-                verify_cells_index.extend(val)
-            if min(verify_cells_index) < 1:
-                raise ValueError("Min value is 1")
-            self.merge_cells_index[sheet_name] = merge_cells
+        return sheet_name if self.sheet_names[sheet_name] == 1 else f"{sheet_name}{self.sheet_names[sheet_name]}"
+
+    @staticmethod
+    def _shard_merge_cells(merge_cells, merge_ranges: MergedRanges, shard, shard_rows, header_rows):
+        """
+        计算拆分后的工作表中的合并单元格
+
+        合并区域按工作表的行范围截断后平移，只剩一个单元格的区域不再合并；表头中的合并区域在每个续表中重复。
+        不需要拆分时返回原来的merge_cells
+        Args:
+            merge_cells: 要合并的单元格的索引
+            merge_ranges: 检查过的合并单元格区域的索引
+            shard: 拆分后的工作表的序号，从0开始
+            shard_rows: 每个工作表中表体的行数
+            header_rows: 表头的行数
+        Returns:
+
+        """
+        if not merge_ranges or shard == 0 and all(val[2] <= shard_rows + header_rows for val in merge_ranges):
+            return merge_cells
+        offset = shard * shard_rows
+        first_row, last_row = offset + header_rows + 1, offset + shard_rows + header_rows
+        if shard == 0:
+            first_row = 1
+        shard_merge_cells = []
+        for start_row, start_column, end_row, end_column in merge_ranges:
+            if header_rows and end_row <= header_rows:
+                shard_merge_cells.append((start_row, start_column, end_row, end_column))
+                continue
+            start_row, end_row = max(start_row, first_row), min(end_row, last_row)
+            if start_row > end_row or (start_row == end_row and start_column == end_column):
+                continue
+            if shard:
+                start_row, end_row = start_row - offset, end_row - offset
+            shard_merge_cells.append((start_row, start_column, end_row, end_column))
+        return shard_merge_cells
 
     # noinspection PyProtectedMember
-    def export_book(self, freeze_panes=True):
-        """Returns XLSX representation of DataBook."""
+    def export_book(self, freeze_panes=True, engine="auto", workers=None):
+        """
+        Returns XLSX representation of DataBook.
+        Args:
+            freeze_panes: 是否冻结首行
+            engine: 生成引擎，auto根据工作表使用的特性自动选择，raw直接生成SpreadsheetML，openpyxl使用openpyxl生成；
+                auto在生成时才能发现raw不支持的单元格(公式、非法字符、带时区的时间等)，遇到时会丢弃已经生成的部分，
+                整个工作簿重新使用openpyxl生成
+            workers: 并行生成工作表的进程数，默认使用初始化时的设置，只对raw引擎生效
+        Returns:
 
+        """
+        if engine not in ("auto", "raw", "openpyxl"):
+            raise ValueError("engine必须是auto,raw,openpyxl")
+        if self.streaming:
+            stream = BytesIO()
+            self.excel_book.save(stream)
+            return stream.getvalue()
+
+        # 分隔行等特性只有openpyxl支持，其他普通的表格直接生成XML，速度快很多
+        if engine == "raw" or (engine == "auto" and not any(dset._separators for dset in self.excel_book._datasets)):
+            from .rawxlsx import UnsupportedFeature
+            try:
+                return self._export_raw_book(freeze_panes, self.workers if workers is None else workers)
+            except UnsupportedFeature:
+                if engine == "raw":
+                    raise
+        return self._export_openpyxl_book(freeze_panes)
+
+    # noinspection PyProtectedMember
+    def _export_raw_book(self, freeze_panes=True, workers=None):
+        """
+        直接生成SpreadsheetML格式的工作簿，不经过openpyxl的对象模型
+        Args:
+            freeze_panes: 是否冻结首行
+            workers: 并行生成工作表的进程数
+        Returns:
+
+        """
+        from .rawxlsx import CellStyles, SharedStrings, UnsupportedFeature, render_sheet, write_workbook
+
+        datasets = self.excel_book._datasets
+        sheet_titles, sheet_options = [], []
+        for i, dset in enumerate(datasets):
+            if dset._separators:
+                raise UnsupportedFeature("separators")
+            title = dset.title if dset.title else 'Sheet%s' % i
+            sheet_titles.append(title)
+            sheet_options.append({"parse_cell": self._parse_cell, "has_header": bool(dset.headers),
+                                  "freeze_panes": freeze_panes, "merge_cells": self.merge_cells_index.get(title),
+                                  "native_types": self.native_types, "tab_selected": i == 0})
+
+        shared_strings, cell_styles = SharedStrings(), CellStyles()
+        stream = BytesIO()
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+            serial = range(len(datasets))
+            if workers and workers > 1 and len(datasets) > 1:
+                serial = self._render_parallel(archive, datasets, sheet_options, workers, cell_styles)
+            for i in serial:
+                with archive.open(f"xl/worksheets/sheet{i + 1}.xml", "w") as sheet_file:
+                    render_sheet(datasets[i]._package(dicts=False), sheet_file.write, shared_strings=shared_strings,
+                                 cell_styles=cell_styles, **sheet_options[i])
+            write_workbook(archive, sheet_titles, shared_strings, cell_styles)
+        return stream.getvalue()
+
+    @staticmethod
+    def _render_parallel(archive, datasets, sheet_options, workers, cell_styles) -> list:
+        """
+        在多个子进程中生成工作表
+
+        子进程使用内联字符串，样式使用预先分配的索引范围，主进程只放置样式并写入工作表的XML，不需要替换工作表中的索引。
+        工作表的数据作为参数传给子进程
+        Args:
+            archive: 工作簿的zip文件
+            datasets: 工作表
+            sheet_options: 每个工作表的render_sheet的其他参数
+            workers: 进程数
+            cell_styles: 工作簿的样式表
+        Returns:
+            样式数量超过预先分配的范围，需要在主进程中生成的工作表的索引
+        """
+        from .rawxlsx import render_sheet_part
+
+        sheet_count = len(datasets)
+        block_size = min(STYLE_BLOCK_SIZE, (MAX_CELL_STYLES - 1) // sheet_count)
+        style_starts = [1 + i * block_size for i in range(sheet_count)]
+        serial = []
+        with ProcessPoolExecutor(max_workers=min(workers, sheet_count)) as executor:
+            # noinspection PyProtectedMember
+            parts = executor.map(render_sheet_part, (dset._package(dicts=False) for dset in datasets),
+                                 sheet_options, style_starts, repeat(block_size))
+            for i, part in enumerate(parts):
+                if part is None:
+                    serial.append(i)
+                    continue
+                data, style_keys = part
+                cell_styles.place(style_starts[i], style_keys)
+                archive.writestr(f"xl/worksheets/sheet{i + 1}.xml", data)
+        if serial:
+            # 主进程中生成的工作表的样式放在所有预先分配的样式之后
+            cell_styles.place(1 + sheet_count * block_size, [])
+        return serial
+
+    # noinspection PyProtectedMember
+    def _export_openpyxl_book(self, freeze_panes=True):
+        """
+        使用openpyxl生成工作簿
+        Args:
+            freeze_panes: 是否冻结首行
+        Returns:
+
+        """
         wb = Workbook()
         for sheet in wb.worksheets:
             wb.remove(sheet)
+        style_cache = ExcelStyleCache(wb)
+        merge_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
         for i, dset in enumerate(self.excel_book._datasets):
             ws = wb.create_sheet()
             ws.title = dset.title if dset.title else 'Sheet%s' % i
-            self.dset_sheet(dset, ws, freeze_panes=freeze_panes)
+            merge_ranges = MergedRanges(self.merge_cells_index.get(ws.title))
+            self.dset_sheet(dset, ws, freeze_panes=freeze_panes, style_cache=style_cache,
+                            native_types=self.native_types,
+                            covered_cells=merge_ranges.covered_cells if merge_ranges else None)
             # 合并单元格
-            if ws.title in self.merge_cells_index:
-                for ws_row_col in self.merge_cells_index[ws.title]:
+            if merge_ranges:
+                for ws_row_col in merge_ranges:
                     ws.merge_cells(start_row=ws_row_col[0], start_column=ws_row_col[1], end_row=ws_row_col[2],
                                    end_column=ws_row_col[3])
-                    ws._get_cell(ws_row_col[0], ws_row_col[1]).alignment = Alignment(
-                        horizontal="center", vertical="center", wrap_text=True)
+                    ws._get_cell(ws_row_col[0], ws_row_col[1]).alignment = merge_alignment
         stream = BytesIO()
         wb.save(stream)
         return stream.getvalue()
 
     # noinspection PyProtectedMember
     @staticmethod
-    def dset_sheet(dataset, ws, freeze_panes=True):
-        """Completes given worksheet from given Dataset."""
+    def dset_sheet(dataset, ws, freeze_panes=True, style_cache: ExcelStyleCache = None, native_types=False,
+                   covered_cells=None):
+        """Completes given worksheet from given Dataset, cells covered by merged ranges are skipped."""
         _package = dataset._package(dicts=False)
 
         for i, sep in enumerate(dataset._separators):
             _offset = i
             _package.insert((sep[0] + _offset), (sep[1],))
 
-        bold = Font(bold=True)
-
-        for i, row in enumerate(_package):
-            row_number = i + 1
-            for j, row_cell_value in enumerate(row):
-                col_idx = get_column_letter(j + 1)
-                cell = ws['%s%s' % (col_idx, row_number)]
-                cell_horizontal, cell_vertical = None, None
-                if isinstance(row_cell_value, dict):
-                    cell_color: str = row_cell_value.get("color", None)
-                    # 处理水平居中
-                    cell_horizontal: str = row_cell_value.get("horizontal", None)
-                    if cell_horizontal and cell_horizontal not in ("general", "left", "center", "right"):
-                        cell_horizontal = "general"  # 默认对其方式
-
-                    # 处理垂直居中
-                    cell_vertical: str = row_cell_value.get("vertical", None)
-                    if cell_vertical and cell_vertical not in ("top", "center", "bottom"):
-                        cell_vertical = "center"  # 默认对其方式
-
-                    cell_value: Union[str, int, float] = row_cell_value.get("value") or ""
-                    if cell_color:
-                        cell.fill = PatternFill("solid", fgColor=cell_color.lstrip("# "))
-                else:
-                    cell_value = row_cell_value or ""
-                # 设置对齐方式
-                cell.alignment = Alignment(wrap_text=True, horizontal=cell_horizontal, vertical=cell_vertical)
-                # 增加边框单线，这里是固定的
-                thin = Side(border_style="thin", color="000000")
-                cell.border = Border(top=thin, left=thin, right=thin, bottom=thin)
-                # bold headers
-                if (row_number == 1) and dataset.headers:
-                    cell.value = cell_value
-                    cell.font = bold
-                    if freeze_panes:
-                        #  Export Freeze only after first Line
-                        ws.freeze_panes = 'A2'
-                # bold separators
-                elif len(row) < dataset.width:
-                    cell.value = cell_value
-                    cell.font = bold
-                # wrap the rest
-                else:
-                    cell.value = cell_value
+        style_cache = style_cache or ExcelStyleCache(ws.parent)
+        if freeze_panes and dataset.headers:
+            #  Export Freeze only after first Line
+            ws.freeze_panes = 'A2'
+
+        for row_number, row in enumerate(_package, 1):
+            # bold headers, bold separators
+            is_bold = (row_number == 1 and bool(dataset.headers)) or len(row) < dataset.width
+            covered = covered_cells.get(row_number, ()) if covered_cells else ()
+            for column_number, row_cell_value in enumerate(row, 1):
+                if column_number in covered:
+                    # 合并后只保留左上角单元格的值，被合并的单元格由openpyxl合并时生成
+                    continue
+                cell_value, cell_color, cell_horizontal, cell_vertical, number_format = ExcelWriter._parse_cell(
+                    row_cell_value, native_types)
+                cell = ws._get_cell(row_number, column_number)
+                cell._style = copy(style_cache.get(cell_color, cell_horizontal, cell_vertical, is_bold, number_format))
+                cell.value = cell_value
+
+    @staticmethod
+    def _parse_cell(row_cell_value, native_types=False):
+        """
+        解析单元格的值和样式
+        Args:
+            row_cell_value: 单元格的值，字典时可以包含value、color、horizontal、vertical
+            native_types: 是否为原生类型的单元格设置数字格式
+        Returns:
+            (cell_value, cell_color, cell_horizontal, cell_vertical, number_format)
+        """
+        cell_color, cell_horizontal, cell_vertical = None, None, None
+        if isinstance(row_cell_value, dict):
+            cell_color: str = row_cell_value.get("color", None)
+            if cell_color:
+                cell_color = cell_color.lstrip("# ")
+            # 处理水平居中
+            cell_horizontal: str = row_cell_value.get("horizontal", None)
+            if cell_horizontal and cell_horizontal not in ("general", "left", "center", "right"):
+                cell_horizontal = "general"  # 默认对其方式
+
+            # 处理垂直居中
+            cell_vertical: str = row_cell_value.get("vertical", None)
+            if cell_vertical and cell_vertical not in ("top", "center", "bottom"):
+                cell_vertical = "center"  # 默认对其方式
+
+            cell_value: Union[str, int, float] = row_cell_value.get("value") or ""
+        else:
+            cell_value = row_cell_value or ""
+        number_format = None
+        if native_types:
+            cell_value, number_format = ExcelWriter._native_value(cell_value)
+        return cell_value, cell_color, cell_horizontal, cell_vertical, number_format
+
+    @staticmethod
+    def _native_value(value):
+        """
+        获取原生类型单元格的值和数字格式
+
+        日期时间的格式按类型缓存，Decimal按小数位数缓存；Excel不支持时区，带时区的时间会去掉时区信息
+        Args:
+            value: 单元格的值
+        Returns:
+            (value, number_format)
+        """
+        value_type = type(value)
+        if value_type is Decimal:
+            exponent = value.as_tuple().exponent
+            key = (Decimal, exponent)
+            number_format = _NUMBER_FORMATS.get(key)
+            if number_format is None and isinstance(exponent, int):
+                number_format = "0" if exponent >= 0 else f"0.{'0' * -exponent}"
+                _NUMBER_FORMATS[key] = number_format
+            return value, number_format
+
+        number_format = _NUMBER_FORMATS.get(value_type)
+        if number_format is None:
+            if value_type in (str, int, float, bool):
+                return value, None
+            # datetime等类型的子类，例如pandas.Timestamp
+            for base_type in (datetime, date, time, timedelta):
+                if isinstance(value, base_type):
+                    number_format = _NUMBER_FORMATS[value_type] = _NUMBER_FORMATS[base_type]
+                    break
+            else:
+                return value, None
+        if getattr(value, "tzinfo", None) is not None:
+            value = value.replace(tzinfo=None)
+        return value, number_format
+
+    # noinspection PyProtectedMember
+    def stream_sheet(self, sheet_name, headers, rows, merge_cells=None):
+        """
+        流式写入工作表，每一行直接写入只写工作表，不再缓存整个工作表的数据
+
+        行的长度和表头不一致时和tablib一样抛出InvalidDimensions，已经写入的行保留在工作表中
+        Args:
+            sheet_name: 工作表的名称
+            headers: 表头
+            rows: 表体数据的迭代器
+            merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始
+        Returns:
+
+        """
+        if not isinstance(merge_cells, MergedRanges):
+            merge_cells = MergedRanges(merge_cells)
+        ws = self.excel_book.create_sheet(sheet_name)
+        # 只写工作表中冻结窗格和合并单元格需要在写入行之前设置
+        if self.freeze_panes and headers:
+            ws.freeze_panes = 'A2'
+        for start_row, start_column, end_row, end_column in merge_cells:
+            ws.merged_cells.add(CellRange(min_row=start_row, min_col=start_column,
+                                          max_row=end_row, max_col=end_column))
+        merge_anchors, covered_cells = merge_cells.anchors, merge_cells.covered_cells
+
+        style_cache = self._stream_style_cache
+        if style_cache is None:
+            style_cache = self._stream_style_cache = ExcelStyleCache(self.excel_book)
+
+        def write_row(row_number, row, is_bold):
+            ws_row = []
+            covered = covered_cells.get(row_number, ())
+            for column_number, row_cell_value in enumerate(row, 1):
+                if column_number in covered:
+                    # 被合并的单元格不需要值，只保留边框
+                    cell = WriteOnlyCell(ws)
+                    cell._style = copy(style_cache.get())
+                    ws_row.append(cell)
+                    continue
+                cell_value, cell_color, cell_horizontal, cell_vertical, number_format = self._parse_cell(
+                    row_cell_value, self.native_types)
+                if (row_number, column_number) in merge_anchors:
+                    cell_horizontal, cell_vertical = "center", "center"
+                cell = WriteOnlyCell(ws, value=cell_value)
+                cell._style = copy(style_cache.get(cell_color, cell_horizontal, cell_vertical, is_bold, number_format))
+                ws_row.append(cell)
+            ws.append(ws_row)
+
+        # 和tablib.Dataset.append一样检查行的长度，列数由表头或者第一行确定
+        width = len(headers) if headers else None
+        row_number = 1
+        if headers:
+            write_row(row_number, headers, True)
+            row_number += 1
+        for row in rows:
+            if width is None:
+                width = len(row)
+            elif len(row) != width:
+                # 结束工作表的XML，报错后工作簿仍然可以保存
+                ws.close()
+                raise tablib.InvalidDimensions
+            write_row(row_number, row, False)
+            row_number += 1
 
     def save(self, ):
         """
@@ -212,5 +575,9 @@ class ExcelWriter(object):
         else:
             file_path = Path(self.excel_path).joinpath(self.excel_name).abspath()
 
-        with open(file_path, "wb") as f:
-            f.write(self.export_book())
+        if self.streaming:
+            # 流式模式直接保存到文件，避免在内存中再生成一份完整的文件内容
+            self.excel_book.save(file_path)
+        else:
+            with open(file_path, "wb") as f:
+                f.write(self.export_book())
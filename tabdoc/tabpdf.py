@@ -6,26 +6,520 @@
 @software: PyCharm
 @time: 19-2-11 下午6:14
 """
-from typing import MutableMapping, Sequence
+import hashlib
+import marshal
+import os
+import re
+import stat
+import threading
+from functools import lru_cache, partial
+from bisect import bisect_left, bisect_right
+from itertools import chain, groupby, islice
+from operator import mul
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
 
+import reportlab
 from path import Path
 from reportlab.lib import colors
 from reportlab.lib.fonts import addMapping
 from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle, StyleSheet1, getSampleStyleSheet
 from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from reportlab.pdfbase.ttfonts import TTEncoding, TTFNameBytes, TTFont, TTFontFace
+from reportlab.platypus import (Flowable, Frame, PageBreak, PageTemplate, Paragraph, SimpleDocTemplate, Spacer, Table,
+                                TableStyle)
 
-__all__ = ("PDFWriter",)
+from .utils import MergedRanges, RowNormalizer, iter_rows, split_frame, split_header
 
-pdfmetrics.registerFont(
-    TTFont('simhei', Path(__file__).dirname().joinpath("templates/SimHei.ttf").abspath()))
-addMapping('simhei', 0, 0, 'simhei')  # normal
-addMapping('simhei', 0, 1, 'simhei_italic')  # italic
-addMapping('simhei', 1, 0, 'simhei_bold')  # bold
-addMapping('simhei', 1, 1, 'simhei_boldItalic')  # italic and bold
+__all__ = ("PDFWriter", "register_font", "register_style", "get_paragraph_style", "FrozenParagraphStyle")
+
+DEFAULT_FONT_NAME = "simhei"
+DEFAULT_FONT_PATH = Path(__file__).dirname().joinpath("templates/SimHei.ttf").abspath()
+
+# 已经注册的字体，{字体名称: 字体文件路径}
+_registered_fonts: Dict[str, str] = {}
+_font_lock = threading.Lock()
+
+# 共享的段落样式，{(字体名称, 样式名称, 对齐方式): 样式}
+_paragraph_styles: Dict[Tuple[str, str, Optional[int]], "FrozenParagraphStyle"] = {}
+# 自定义的样式，{样式名称: (父样式名称, 样式属性)}
+_custom_styles: Dict[str, Tuple[str, dict]] = {}
+_sample_styles: Optional[StyleSheet1] = None
+_style_lock = threading.RLock()
+
+# 单元格的默认字号和左右边距之和，和reportlab中Table的默认值一致
+CELL_FONT_SIZE = 10
+CELL_PADDING = 12
+# 根据内容计算列宽时读取的行数，列宽的最小值，以及最大值占页面宽度的比例
+WIDTH_SAMPLE_ROWS = 100
+MIN_COLUMN_WIDTH = 0.5 * inch
+MAX_COLUMN_RATIO = 1 / 3
+# 不需要Paragraph处理的纯文本，没有标签、实体、换行和连续的空白
+_PLAIN_TEXT_RE = re.compile(r"[^<>&\s]+(?: [^<>&\s]+)*")
+# Paragraph换行结果的缓存，{(文本, 宽度, 样式): ((宽度, 高度), wrap后的属性)}
+_wrap_cache: Dict[tuple, tuple] = {}
+_WRAP_CACHE_SIZE = 10000
+# reportlab中Frame默认的上下内边距，以及判断表格是否在页面顶部时的误差
+FRAME_PADDING = 6
+SPLIT_FUZZ = 1e-6
+# 水印的form XObject的名称
+WATER_MARK_FORM = "tabdocWaterMark"
+# 单元格样式对应的TableStyle命令，样式为(背景颜色, 水平对齐方式, 垂直对齐方式)
+_STYLE_COMMANDS = ("BACKGROUND", "ALIGN", "VALIGN")
+# 和ExcelWriter一致的单元格对齐方式，转换为reportlab的对齐方式
+_HORIZONTAL_ALIGN = {"left": "LEFT", "center": "CENTER", "right": "RIGHT"}
+_VERTICAL_ALIGN = {"top": "TOP", "center": "MIDDLE", "bottom": "BOTTOM"}
+_PARAGRAPH_ALIGNMENT = {"LEFT": 0, "CENTER": 1, "RIGHT": 2}
+
+
+def _font_cache_dir() -> Path:
+    """
+    字体缓存目录，可以通过环境变量TABDOC_CACHE_DIR指定
+    Returns:
+
+    """
+    cache_dir = os.environ.get("TABDOC_CACHE_DIR")
+    if not cache_dir:
+        cache_dir = Path(os.environ.get("XDG_CACHE_HOME") or Path("~/.cache").expanduser()).joinpath("tabdoc")
+    return Path(cache_dir)
+
+
+def _is_private(path: str) -> bool:
+    """
+    文件或者目录是否属于当前用户并且其他用户不能写入，不支持的平台上总是为True
+    Args:
+        path: 文件或者目录的路径
+    Returns:
+
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    path_stat = os.stat(path)
+    return path_stat.st_uid == os.getuid() and not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _pdf_scale(units_per_em: int):
+    """
+    和reportlab中TTFontFile._pdfScale的计算一致
+    Args:
+        units_per_em: 字体的unitsPerEm
+    Returns:
+
+    """
+    return (lambda x: x) if units_per_em == 1000 else partial(mul, 1000 / units_per_em)
+
+
+def _load_ttfont(font_name: str, font_path: str) -> TTFont:
+    """
+    加载TrueType字体
+
+    解析出的字宽、字形位置和度量等数据按字体文件的hash和reportlab的版本用marshal缓存到磁盘上，只保存普通的数据，
+    不保存reportlab的对象，再次加载时不需要重新解析字体文件。缓存目录和文件只有当前用户可以写入，
+    否则不使用缓存；缓存读写失败时直接解析字体文件。
+    Args:
+        font_name: 字体名称
+        font_path: 字体文件路径
+    Returns:
+
+    """
+    with open(font_path, "rb") as f:
+        font_data = f.read()
+    cache_dir = _font_cache_dir()
+    cache_file = cache_dir.joinpath(f"{hashlib.sha1(font_data).hexdigest()}-reportlab{reportlab.Version}.marshal")
+    try:
+        if not (_is_private(cache_dir) and _is_private(cache_file)):
+            raise PermissionError(cache_file)
+        with open(cache_file, "rb") as f:
+            font_attrs, face_attrs, face_names = marshal.load(f)
+    except Exception:
+        pass
+    else:
+        face = TTFontFace.__new__(TTFontFace)
+        face.__dict__.update(face_attrs)
+        face.__dict__.update({key: TTFNameBytes(value) for key, value in face_names.items()})
+        face._ttf_data, face.filename, face._pdfScale = font_data, font_path, _pdf_scale(face.unitsPerEm)
+        font = TTFont.__new__(TTFont)
+        font.__dict__.update(font_attrs)
+        font.fontName, font.face, font.encoding, font.state = font_name, face, TTEncoding(), WeakKeyDictionary()
+        return font
+
+    font = TTFont(font_name, font_path)
+    # 字体文件的内容、每个文档的字体状态和缩放函数不缓存，加载时重新生成
+    font_attrs = {key: value for key, value in vars(font).items()
+                  if key not in ("fontName", "face", "encoding", "state")}
+    face_attrs, face_names = {}, {}
+    for key, value in vars(font.face).items():
+        if isinstance(value, TTFNameBytes):
+            face_names[key] = bytes(value)
+        elif key not in ("_ttf_data", "filename", "_pdfScale"):
+            face_attrs[key] = value
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            marshal.dump((font_attrs, face_attrs, face_names), f)
+        os.replace(tmp_file, cache_file)
+    except Exception:
+        pass
+    return font
+
+
+def register_font(font_name: str = DEFAULT_FONT_NAME, font_path: Optional[str] = None) -> str:
+    """
+    注册TrueType字体，同一个字体只注册一次，同名的字体已经使用其他的字体文件注册时报错
+
+    字体在第一次使用时才加载，解析后的数据缓存在磁盘上，见_load_ttfont
+    Args:
+        font_name: 字体名称
+        font_path: 字体文件路径，默认使用自带的SimHei字体
+    Returns:
+        字体名称
+    """
+    if font_path is None and font_name in _registered_fonts:
+        return font_name
+    with _font_lock:
+        if font_name in _registered_fonts:
+            if font_path is not None and _registered_fonts[font_name] != os.path.abspath(font_path):
+                raise ValueError(f"字体{font_name}已经使用{_registered_fonts[font_name] or 'reportlab'}注册，"
+                                 f"不能再使用{font_path}注册")
+        else:
+            if font_path is None:
+                if font_name != DEFAULT_FONT_NAME:
+                    # 已经直接通过reportlab注册的字体
+                    pdfmetrics.getFont(font_name)
+                    _registered_fonts[font_name] = ""
+                    return font_name
+                font_path = DEFAULT_FONT_PATH
+            font_path = os.path.abspath(font_path)
+            pdfmetrics.registerFont(_load_ttfont(font_name, font_path))
+            # 只有一种字形，粗体和斜体都使用同一个字体
+            addMapping(font_name, 0, 0, font_name)  # normal
+            addMapping(font_name, 0, 1, font_name)  # italic
+            addMapping(font_name, 1, 0, font_name)  # bold
+            addMapping(font_name, 1, 1, font_name)  # italic and bold
+            _registered_fonts[font_name] = font_path
+    return font_name
+
+
+def _no_water_mark(canvas, doc):
+    """
+    不添加水印的页
+    """
+    pass
+
+
+class FrozenParagraphStyle(ParagraphStyle):
+    """
+    不可修改的段落样式，在多个writer和线程之间共享
+
+    需要修改时使用clone派生出普通的ParagraphStyle
+    """
+
+    def __init__(self, name, base: ParagraphStyle, **kwargs):
+        """
+            不可修改的段落样式
+        Args:
+            name: 样式名称
+            base: 复制属性的样式
+            kwargs: 覆盖的样式属性
+        """
+        attrs = {key: value for key, value in vars(base).items() if key not in ("name", "parent")}
+        attrs.update(kwargs, name=name, parent=None)
+        self.__dict__.update(attrs)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"共享的段落样式{self.name}不能修改，请使用clone派生新的样式")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"共享的段落样式{self.name}不能修改，请使用clone派生新的样式")
+
+    def clone(self, name, parent=None, **kwargs) -> ParagraphStyle:
+        style = ParagraphStyle(name, parent)
+        style.__dict__.update({key: value for key, value in vars(self).items() if key not in ("name", "parent")})
+        style.__dict__.update(kwargs)
+        return style
+
+
+def register_style(name: str, parent: str = "Normal", **kwargs):
+    """
+    注册自定义的段落样式，注册后可以通过get_paragraph_style获取
+
+    样式的字体默认使用writer的字体，kwargs中指定fontName时使用指定的字体；重新注册已有的样式后，
+    之后获取的这个样式和继承它的样式都使用新的属性
+    Args:
+        name: 样式名称
+        parent: 父样式名称，可以是getSampleStyleSheet中的样式或者已经注册的样式
+        kwargs: ParagraphStyle的属性
+    Returns:
+
+    """
+    with _style_lock:
+        _custom_styles[name] = (parent, kwargs)
+        # 所有字体和对齐方式的同名样式以及以它为父样式的样式都要重新生成，注册样式很少见，直接清除全部缓存
+        _paragraph_styles.clear()
+
+
+def get_paragraph_style(name: str, alignment: Optional[int] = None,
+                        font_name: str = DEFAULT_FONT_NAME) -> FrozenParagraphStyle:
+    """
+    获取共享的段落样式，每种字体、样式和对齐方式的组合只生成一次
+    Args:
+        name: 样式名称，例如Normal、Heading1，或者通过register_style注册的样式
+        alignment: 对齐方式，0,1,2,4分别为left,center,right,justify，None为样式默认的对齐方式
+        font_name: 字体名称
+    Returns:
+
+    """
+    key = (font_name, name, alignment)
+    style = _paragraph_styles.get(key)
+    if style is None:
+        global _sample_styles
+        with _style_lock:
+            style = _paragraph_styles.get(key)
+            if style is None:
+                if _sample_styles is None:
+                    _sample_styles = getSampleStyleSheet()
+                attrs = {"fontName": font_name}
+                if name in _custom_styles:
+                    parent, custom_attrs = _custom_styles[name]
+                    base = get_paragraph_style(parent, None, font_name)
+                    attrs.update(custom_attrs)
+                else:
+                    base = _sample_styles[name]
+                if alignment is not None:
+                    attrs["alignment"] = alignment
+                style = FrozenParagraphStyle(f"{name}-{font_name}-{alignment}", base, **attrs)
+                _paragraph_styles[key] = style
+    return style
+
+
+@lru_cache(maxsize=65536)
+def string_width(text: str, font_name: str, font_size: float = CELL_FONT_SIZE) -> float:
+    """
+    计算字符串的宽度，按(文本, 字体, 字号)缓存，重复的标签和数字只计算一次
+    Args:
+        text: 字符串
+        font_name: 字体名称
+        font_size: 字号
+    Returns:
+
+    """
+    return pdfmetrics.stringWidth(text, font_name, font_size)
+
+
+def _style_commands(style_rows: Sequence[Optional[Sequence[Optional[tuple]]]]) -> List[tuple]:
+    """
+    把每个单元格的样式合并为尽量少的TableStyle命令
+
+    每种命令单独处理，一行中相邻的相同的值合并为一段，连续几行中列的范围和值都相同的段再合并为一个矩形区域，
+    命令的数量和样式区域的数量成正比，和单元格的数量无关
+    Args:
+        style_rows: 每行单元格的样式，行或者单元格为None时使用表格默认的样式
+    Returns:
+        [(命令, (起始列, 起始行), (结束列, 结束行), 值)]
+    """
+    commands = []
+    for attr, name in enumerate(_STYLE_COMMANDS):
+        open_runs: Dict[tuple, int] = {}  # {(起始列, 结束列, 值): 起始行}
+        for row_index, styles in enumerate(chain(style_rows, (None,))):
+            runs = set()
+            if styles:
+                column = 0
+                for value, group in groupby(cell[attr] if cell else None for cell in styles):
+                    width = sum(1 for _ in group)
+                    if value is not None:
+                        runs.add((column, column + width - 1, value))
+                    column += width
+            for run in [run for run in open_runs if run not in runs]:
+                start_row = open_runs.pop(run)
+                value = colors.toColor(run[2]) if name == "BACKGROUND" else run[2]
+                commands.append((name, (run[0], start_row), (run[1], row_index - 1), value))
+            for run in runs:
+                open_runs.setdefault(run, row_index)
+    return commands
+
+
+class _CachedParagraph(Paragraph):
+    """
+    wrap结果按(文本, 宽度, 样式)缓存的段落
+
+    表格跨页拆分时会再次wrap，相同内容的单元格也只需要换行一次
+    """
+
+    def __init__(self, text, style):
+        super().__init__(text, style)
+        self._cache_text = text
+        # 初始化之后的属性，wrap新增的属性都要缓存，不能只缓存这一次wrap改变的属性
+        self._init_keys = frozenset(vars(self)) | {"_init_keys"}
+
+    def wrap(self, availWidth, availHeight):
+        key = (self._cache_text, availWidth, self.style)
+        cached = _wrap_cache.get(key)
+        if cached is None:
+            size = super().wrap(availWidth, availHeight)
+            state = {key_: value for key_, value in vars(self).items() if key_ not in self._init_keys}
+            if len(_wrap_cache) >= _WRAP_CACHE_SIZE:
+                _wrap_cache.clear()
+            cached = _wrap_cache[key] = (size, state)
+        else:
+            self.__dict__.update(cached[1])
+        return cached[0]
+
+
+class _TableChunks(Flowable):
+    """
+    排版时才逐页生成的表格
+
+    表体的行在排版时才按需读取，每次只生成能放满当前页的表格，放不下的行留到下一页和后面的行一起生成表格，
+    表头在每一页重复。每次只需要计算一页的表格，排版的时间和行数成线性关系，内存占用和页数无关。
+    表格比页面宽时按列分组，第一组放下的行会紧接着在后面几页按其他的列分组显示。
+    """
+    # 每行的最小高度，用来估算一页最多能放下多少行
+    min_row_height = 12
+
+    def __init__(self, rows: Iterator[Sequence], bands: Sequence[int], make_cells: Callable[[int, Sequence], list],
+                 make_table: Callable[[int, List[list]], Table], max_height: Optional[float] = None,
+                 frame_height: Optional[float] = None, pending: Optional[List[Tuple[Sequence, list]]] = None,
+                 exhausted: bool = False):
+        """
+            排版时才逐页生成的表格
+        Args:
+            rows: 表体的行的迭代器
+            bands: 列分组的序号，第一组从rows中逐页生成，其他的组显示第一组已经放下的行
+            make_cells: 根据列分组的序号和行数据生成单元格的函数
+            make_table: 根据列分组的序号和表体的单元格生成带表头的表格的函数
+            max_height: 每一页表格的最大高度，横向的表格每一页只放一个表格
+            frame_height: 一整页的可用高度，用来判断合并区域换页后能不能放下，None为不限制
+            pending: 上一页没有放下的行和第一组的单元格
+            exhausted: rows是否已经读取完
+        """
+        super().__init__()
+        self.rows = rows
+        self.bands = bands
+        self.make_cells = make_cells
+        self.make_table = make_table
+        self.max_height = max_height
+        self.frame_height = frame_height
+        self.pending: List[Tuple[Sequence, list]] = [] if pending is None else pending
+        self.exhausted = exhausted
+        self._table: Optional[Tuple[tuple, Table]] = None  # ((宽度, 高度, 行数), 生成的这一页的表格)
+
+    def _page_table(self, availWidth, height) -> Table:
+        """
+        读取能放满这一页的行，生成这一页的表格，读取的行保存在pending中
+        Args:
+            availWidth: 可用的宽度
+            height: 这一页表格可用的高度
+        Returns:
+
+        """
+        if self._table is not None and self._table[0] == (availWidth, height, len(self.pending)):
+            return self._table[1]
+        band = self.bands[0]
+        count = int(height / self.min_row_height) + 1
+        while True:
+            self._fetch(band, self.pending, count)
+            table = self.make_table(band, [cells for _, cells in self.pending])
+            # 读取的行都能放下时需要再读取一些，保证这一页放满
+            if table.wrap(availWidth, height)[1] > height or self.exhausted:
+                break
+            count *= 2
+        self._table = ((availWidth, height, len(self.pending)), table)
+        return table
+
+    def wrap(self, availWidth, availHeight):
+        height = availHeight if self.max_height is None else min(availHeight, self.max_height)
+        table = self._page_table(availWidth, height)
+        self.hAlign = table.hAlign
+        self.width, self.height = table.wrap(availWidth, height)
+        if len(self.bands) > 1 or self.height > height:
+            # 后面还有换页之后才显示的列分组或者行，这一页剩余的高度都会被占用
+            self.height = max(self.height, height) + availHeight
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        height = availHeight if self.max_height is None else min(availHeight, self.max_height)
+        band, *other_bands = self.bands
+        table, body = self._page_table(availWidth, height), self.pending
+        parts = table.split(availWidth, height)
+        if not parts and body:
+            parts = self._split_spans(availWidth, height, band, body)
+        elif not parts and table.wrap(availWidth, height)[1] <= height:
+            # 没有表体时只有重复的表头，Table.split不会拆分出任何表格，直接使用只有表头的表格
+            parts = [table]
+        if not parts:
+            # 当前页一行也放不下，换页后再拆分
+            return parts
+
+        flowables = [parts[0]]
+        placed = len(parts[0]._cellvalues) - 1
+        placed_rows = [row for row, _ in body[:placed]]
+        for other_band in other_bands:
+            flowables.append(PageBreak())
+            flowables.append(_TableChunks(iter(placed_rows), [other_band], self.make_cells, self.make_table,
+                                          self.max_height, self.frame_height))
+        if self.exhausted and placed == len(body):
+            return flowables
+        if other_bands or self.max_height is not None:
+            flowables.append(PageBreak())
+        # 剩下的行由新的对象继续拆分
+        flowables.append(_TableChunks(self.rows, self.bands, self.make_cells, self.make_table, self.max_height,
+                                      self.frame_height, body[placed:], self.exhausted))
+        return flowables
+
+    def _fetch(self, band: int, body: List[Tuple[Sequence, list]], count: int):
+        """
+        读取表体的行，直到body中有count行或者没有更多的行
+        Args:
+            band: 列分组的序号
+            body: 已经读取的行和单元格
+            count: 需要的行数
+        Returns:
+
+        """
+        need = count - len(body)
+        if need > 0 and not self.exhausted:
+            fetched = list(islice(self.rows, need))
+            body.extend((row, self.make_cells(band, row)) for row in fetched)
+            self.exhausted = len(fetched) < need
+
+    def _split_spans(self, availWidth, height, band: int, body: List[Tuple[Sequence, list]]) -> List[Table]:
+        """
+        截断比一整页还高的合并区域
+
+        reportlab不会在合并区域的中间拆分表格，合并区域换页后能放下时留到下一页；在整页中也放不下时，
+        在这一页能放下的最后一行截断，SPAN命令只包含每一页表格中的行，剩下的行在下一页继续合并
+        Args:
+            availWidth: 可用的宽度
+            height: 这一页表格可用的高度
+            band: 列分组的序号
+            body: 已经读取的行和单元格
+        Returns:
+            截断后的表格，换页后能放下或者一行也放不下时为空列表
+        """
+        page_height = min(filter(None, (self.frame_height, self.max_height)), default=height)
+        self._fetch(band, body, int(page_height / self.min_row_height) + 1)
+        cells = [cells for _, cells in body]
+        if height < page_height - SPLIT_FUZZ and self.make_table(band, cells).split(availWidth, page_height):
+            return []
+        table = self.make_table(band, cells)
+        # 计算所有行的高度，reportlab默认只计算可用高度之内的行
+        table.wrap(availWidth, float("inf"))
+        # 忽略合并区域时能放下的表体的行数，第一行是表头
+        placed, used = -1, 0
+        for row_height in table._rowHeights:
+            used += row_height
+            if used > height:
+                break
+            placed += 1
+        return [self.make_table(band, cells[:placed])] if placed > 0 else []
+
+    def draw(self):
+        # 所有的行都在这一页放下时直接绘制wrap生成的表格
+        self._table[1].drawOn(self.canv, 0, 0)
 
 
 class RotateTable(Table):  # Table Rotate
@@ -53,7 +547,9 @@ class PDFWriter(object):
     pdf book writer
     """
 
-    def __init__(self, pdf_name, pdf_path=None, water_mark="", title=None):
+    def __init__(self, pdf_name, pdf_path=None, water_mark="", title=None, *, font_name=DEFAULT_FONT_NAME,
+                 font_path=None, water_mark_image=None, water_mark_first_page=True, water_mark_later_pages=True,
+                 incremental=False):
         """
             excel book writer
         Args:
@@ -61,12 +557,27 @@ class PDFWriter(object):
             title: 文件title
             pdf_path: pdf path
             water_mark: pdf 水印文字
+            font_name: 字体名称，默认使用自带的SimHei字体，也可以是通过register_font注册的字体
+            font_path: 字体文件路径，指定时会以font_name注册这个字体
+            water_mark_image: pdf 水印图片的路径或者文件对象，和水印文字可以同时使用
+            water_mark_first_page: 第一页是否添加水印
+            water_mark_later_pages: 第一页之后的页是否添加水印
+            incremental: 是否增量排版，添加的内容立即排版到页面上并从story中移除，表格的数据在添加时就会读取
         """
+        self.font_name = register_font(font_name, font_path)
+        self._styles = None
         self.story = []
         self.pdf_name = f"{pdf_name}.pdf"
         self.pdf_path = pdf_path
         self.document = SimpleDocTemplate(self.get_full_name(), pagesize=letter)
         self.document.water_mark = water_mark
+        self.document.water_mark_image = water_mark_image
+        self.water_mark_first_page = water_mark_first_page
+        self.water_mark_later_pages = water_mark_later_pages
+        self.document.font_name = self.font_name
+        self.incremental = incremental
+        self._building = False
+        self._saved = False
         self.alignment_map = {"left": 0, "center": 1, "right": 2, "justify": 4}
         if title:
             self.add_heading(title, alignment="center")
@@ -75,14 +586,28 @@ class PDFWriter(object):
     def styles(self, ):
         """
         获取样式，这里会更改样式的字体，以便于支持中文
+
+        每个writer只生成一次，可以修改；添加内容时使用的是get_paragraph_style中共享的样式
         Args:
         """
+        if self._styles is None:
+            styles = getSampleStyleSheet()
+            for key, value in styles.byName.items():
+                value.fontName = self.font_name
+                styles.byName[key] = value
+            self._styles = styles
+        return self._styles
 
-        styles = getSampleStyleSheet()
-        for key, value in styles.byName.items():
-            value.fontName = "simhei"
-            styles.byName[key] = value
-        return styles
+    def get_style(self, name: str, alignment: Optional[int] = None) -> FrozenParagraphStyle:
+        """
+        获取使用当前字体的共享段落样式
+        Args:
+            name: 样式名称
+            alignment: 对齐方式，None为样式默认的对齐方式
+        Returns:
+
+        """
+        return get_paragraph_style(name, alignment, self.font_name)
 
     def get_full_name(self, ):
         """
@@ -118,19 +643,6 @@ class PDFWriter(object):
         """
         self.save()
 
-    @staticmethod
-    def _reduce_datetimes(row):
-        """Receives a row, converts datetimes to strings."""
-
-        row = list(row)
-
-        for i, val in enumerate(row):
-            if hasattr(val, "strftime"):
-                row[i] = val.strftime("%Y-%m-%d %H:%M:%S")
-            elif hasattr(val, 'isoformat'):
-                row[i] = val.isoformat()
-        return row
-
     def add_heading(self, head_text: str = None, *, level: int = 1, alignment="left"):
         """
         为PDF文档中添加标题
@@ -145,10 +657,9 @@ class PDFWriter(object):
             raise ValueError("alignment必须是left,center,right,justify")
         if level < 1 or level > 6:
             raise ValueError("level必须在1和6之间。")
-        styles = self.styles.get(f'Heading{level}')
-        styles.alignment = self.alignment_map[alignment]
-        self.story.append(Paragraph(head_text, styles))
+        self.story.append(Paragraph(head_text, self.get_style(f'Heading{level}', self.alignment_map[alignment])))
         self.story.append(Spacer(1, 0.25 * inch))
+        self._flush_story()
 
     def add_paragraph(self, paragraph_text, alignment="left"):
         """
@@ -162,113 +673,352 @@ class PDFWriter(object):
 
         if alignment not in self.alignment_map:
             raise ValueError("alignment必须是left,center,right,justify")
-        styles = self.styles.get('Normal')
-        styles.alignment = self.alignment_map[alignment]
-        self.story.append(Paragraph(paragraph_text, styles))
+        self.story.append(Paragraph(paragraph_text, self.get_style('Normal', self.alignment_map[alignment])))
         self.story.append(Spacer(1, 0.15 * inch))
+        self._flush_story()
 
-    # noinspection PyUnusedLocal
-    def add_table(self, table_data: list, table_name=None, data_align='CENTER', table_halign='CENTER',
-                  cell_styles: list = None, is_landscape=False):
+    def add_table(self, table_data: Iterable, table_name=None, data_align='CENTER', table_halign='CENTER',
+                  cell_styles: list = None, is_landscape=False, repeat_columns=1, merge_cells=None):
         """
         为pdf添加表格数据
         Args:
             table_name: 表格的名称
-            table_data: 表格的数据， 必须是列表中嵌套元祖、列表或者字典（从records查询出来的数据库的数据）
+            table_data: 表格的数据， 可以是列表、生成器或者数据库游标，每行是元祖、列表或者字典（从records查询出来的数据库的数据），
+                除第一行外的数据在保存时才读取，表体的行比表头长时抛出ValueError；单元格是字典时可以包含value、color、horizontal、vertical
             data_align: The alignment of the data inside the table ('LEFT', 'CENTER', 'RIGHT')
             table_halign: Horizontal alignment of the table on the page('LEFT', 'CENTER', 'RIGHT')
-            cell_styles: 每个单元格样式
+            cell_styles: 追加到每一页表格的TableStyle命令，行列是每一页表格中的索引，(0, 0)是表头的第一个单元格
             is_landscape: 是否横向展示，默认false
+            repeat_columns: 表格比页面宽时按列分组显示，每组都重复显示的前几列
+            merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始，
+                第1行是表头
+        Returns:
+
+        """
+        # 只预读第一行作为表头，表体逐行补齐长度并转换时间类型、None和Decimal；列宽按表头的列数计算，
+        # 比表头长的行不能显示完整，直接报错
+        header, rows = split_header(table_data, [[""]], RowNormalizer(reduce_none=True, reduce_decimals=True),
+                                    "table_data值数据类型错误,请检查", strict=True)
+        self._add_table_rows(header, rows, table_name, data_align, table_halign, cell_styles, is_landscape,
+                             repeat_columns, merge_cells)
+
+    def add_table_frame(self, frame, table_name=None, data_align='CENTER', table_halign='CENTER',
+                        cell_styles: list = None, is_landscape=False, repeat_columns=1, merge_cells=None):
+        """
+        为pdf添加列式数据的表格
+        Args:
+            frame: 表格的数据，pandas.DataFrame、numpy结构化数组或者pyarrow.Table
+            table_name: 表格的名称
+            data_align: The alignment of the data inside the table ('LEFT', 'CENTER', 'RIGHT')
+            table_halign: Horizontal alignment of the table on the page('LEFT', 'CENTER', 'RIGHT')
+            cell_styles: 追加到每一页表格的TableStyle命令，行列是每一页表格中的索引，(0, 0)是表头的第一个单元格
+            is_landscape: 是否横向展示，默认false
+            repeat_columns: 表格比页面宽时按列分组显示，每组都重复显示的前几列
+            merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始，
+                第1行是表头
+        Returns:
+
+        """
+        # 按列向量化处理时间和空值，object列中的Decimal等再和add_table一样逐行转换，已经转换过的行直接返回
+        header, rows = split_frame(frame)
+        rows = iter_rows(rows, reduce_row=RowNormalizer(reduce_none=True, reduce_decimals=True))
+        self._add_table_rows(header, rows, table_name, data_align, table_halign, cell_styles, is_landscape,
+                             repeat_columns, merge_cells)
+
+    def _add_table_rows(self, header, rows, table_name=None, data_align='CENTER', table_halign='CENTER',
+                        cell_styles: list = None, is_landscape=False, repeat_columns=1, merge_cells=None):
+        """
+        添加已经处理好的表头和表体数据
+        Args:
+            header: 表头
+            rows: 表体数据的迭代器
+            table_name: 表格的名称
+            data_align: The alignment of the data inside the table ('LEFT', 'CENTER', 'RIGHT')
+            table_halign: Horizontal alignment of the table on the page('LEFT', 'CENTER', 'RIGHT')
+            cell_styles: 追加到每一页表格的TableStyle命令，行列是每一页表格中的索引，(0, 0)是表头的第一个单元格
+            is_landscape: 是否横向展示，默认false
+            repeat_columns: 表格比页面宽时按列分组显示，每组都重复显示的前几列
+            merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)],最小值从1开始，
+                第1行是表头
         Returns:
 
         """
-        table_data = table_data if table_data else [[""]]
         self.story.append(PageBreak())
         if table_name:
-            styles = self.styles.get('Heading4')
-            styles.alignment = self.alignment_map.get(table_halign.lower(), "center")
+            styles = self.get_style('Heading4', self.alignment_map.get(table_halign.lower(), 1))
             if is_landscape:
                 self.story.append(RotateParagraph(table_name, styles))
             else:
                 self.story.append(Paragraph(table_name, styles))
             # self.story.append(Spacer(1, 0.15 * inch)) # 这里是增加间距，测试后发现去掉更美观点
 
-        for index, row in enumerate(table_data):
-            if not isinstance(row, (MutableMapping, Sequence)):
-                raise ValueError("table_data值数据类型错误,请检查")
-            table_data[index] = row[:36]  # 解决超过36列行高大于一页而报错的问题
-
-        # 处理list或者tuple个别长度不一致的情况
-        first = table_data[0]
-        if isinstance(first, Sequence):
-            for index, row in enumerate(table_data[1:], 1):
-                diff = len(row) - len(first)
-                if abs(diff) > 0:
-                    if isinstance(row, list):
-                        row.extend(["" for _ in range(diff)])
-                    else:
-                        table_data[index] = [*row, *["" for _ in range(diff)]]
-                table_data[index] = self._reduce_datetimes(row)
+        merge_ranges = MergedRanges(merge_cells, max_column=len(header),
+                                    error_msg=f"merge_cells值错误,最小值为1,最大列数为{len(header)}")
+        # 列宽根据表头和前面的行的内容计算，比页面宽时按列分组
+        sample_rows = list(islice(rows, WIDTH_SAMPLE_ROWS))
+        rows = enumerate(chain(sample_rows, rows), 2)  # 行号和merge_cells一致，表头是第1行
+        table_width = letter[1] - 2 * inch if is_landscape else self.document.width
+        column_bands = self._column_bands(header, sample_rows, table_width, repeat_columns)
+        band_merges = [self._band_merges(merge_ranges, columns) for columns, _ in column_bands]
+        cell_style = self.get_style("Normal", _PARAGRAPH_ALIGNMENT.get(data_align.upper(), 0))
+        # (列,行) (0, 0)(-1, -1)代表0列0行到所有的单元格
+        base_commands = [('FONT', (0, 0), (-1, -1), self.font_name),  # 所有单元格设置雅黑字体
+                         ('ALIGN', (0, 0), (-1, -1), data_align),  # 所有数据的对齐方式
+                         ('INNERGRID', (0, 0), (-1, -1), 0.50, colors.black),
+                         ('BOX', (0, 0), (-1, -1), 0.25, colors.black)]
+        table_cls = RotateTable if is_landscape else Table
 
-        else:
-            for index, row in enumerate(table_data[1:], 1):
-                diff = len(row) - len(first)
-                if abs(diff) > 0:
-                    row_ = [*list(row.values()), *["" for _ in range(diff)]]
-                    table_data[index] = self._reduce_datetimes(row_)
-                else:
-                    table_data[index] = self._reduce_datetimes(row.values())
-        cell_styles = self.styles["Normal"]
-        for row_index, row in enumerate(table_data):
-            for column_index, one_value in enumerate(row):
-                table_data[row_index][column_index] = Paragraph(str(one_value) if one_value else "", cell_styles)
-
-        # 第一列的宽度是其他列的两倍,第二列的宽度是其他列的1.5倍
-        if is_landscape:
-            column_len, column_width_per = len(table_data[-1]), (letter[1] - 2 * inch) / (len(table_data[-1]) + 2)
-        else:
-            column_len, column_width_per = len(table_data[-1]), self.document.width / (len(table_data[-1]) + 2)
+        def make_cells(band, item):
+            row_number, row = item
+            spans, covered, anchors = band_merges[band]
+            cells, styles = self._table_cells(row, *column_bands[band], cell_style, covered.get(row_number, ()),
+                                              anchors.get(row_number))
+            return row_number, cells, styles
 
-        column_width = [column_width_per * 2, column_width_per * 1.5,
-                        *[column_width_per for _ in range(column_len - 2)]]
-        if is_landscape:
-            table = RotateTable(table_data, hAlign=table_halign, colWidths=column_width)
-        else:
-            table = Table(table_data, hAlign=table_halign, colWidths=column_width)
-        # (列,行) (0, 0)(-1, -1)代表0列0行到所有的单元格
-        if not cell_styles:
-            table_style = TableStyle([('FONT', (0, 0), (-1, -1), 'simhei'),  # 所有单元格设置雅黑字体
-                                      ('ALIGN', (0, 0), (-1, 0), 'LEFT'),  # 第一列左对齐
-                                      ('ALIGN', (0, 0), (0, 0), data_align),  # 第一个单元格
-                                      ('ALIGN', (1, 0), (-1, -1), data_align),  # 第一列到剩下的所有数据
-                                      ('INNERGRID', (0, 0), (-1, -1), 0.50, colors.black),
-                                      ('BOX', (0, 0), (-1, -1), 0.25, colors.black)])
-        else:
-            table_style = TableStyle([('FONT', (0, 0), (-1, -1), 'simhei'),  # 所有单元格设置雅黑字体
-                                      ('INNERGRID', (0, 0), (-1, -1), 0.50, colors.black),
-                                      ('BOX', (0, 0), (-1, -1), 0.25, colors.black)])
+        header_cells = [make_cells(band, (1, header)) for band in range(len(column_bands))]
 
-        table.setStyle(table_style)
-        self.story.append(table)
+        def make_table(band, body):
+            table_rows = [header_cells[band], *body]
+            commands = list(base_commands)
+            if any(styles for _, _, styles in table_rows):
+                commands.extend(_style_commands([styles for _, _, styles in table_rows]))
+            commands.extend(self._span_commands(band_merges[band][0], [row_number for row_number, _, _ in body]))
+            commands.extend(cell_styles or ())
+            return table_cls([cells for _, cells, _ in table_rows], hAlign=table_halign,
+                             colWidths=column_bands[band][1], style=TableStyle(commands), repeatRows=1)
+
+        # 表体在保存时才逐行读取并按页生成表格
+        self.story.append(_TableChunks(rows, range(len(column_bands)), make_cells, make_table,
+                                       max_height=letter[0] - 2 * inch if is_landscape else None,
+                                       frame_height=self.document.height - 2 * FRAME_PADDING))
+        self._flush_story()
+
+    def _column_bands(self, header, sample_rows, table_width, repeat_columns=1) -> List[Tuple[List[int], List[float]]]:
+        """
+        根据内容计算列宽，表格比页面宽时按列分组
+
+        每列的宽度为表头和示例行中最宽的文本的宽度，限制在最小值和页面宽度的一定比例之间；
+        每组都包括前repeat_columns列，每组的列宽按比例缩放到表格的宽度
+        Args:
+            header: 表头
+            sample_rows: 用来计算列宽的行
+            table_width: 表格的宽度
+            repeat_columns: 每组都重复显示的前几列
+        Returns:
+            [(列的索引, 列宽)]
+        """
+        column_len = len(header)
+        natural_width = [0.0] * column_len
+        font_name = self.font_name
+        for row in chain((header,), sample_rows):
+            for index, one_value in enumerate(row[:column_len]):
+                if isinstance(one_value, dict):
+                    one_value = one_value.get("value")
+                if one_value:
+                    width = string_width(str(one_value), font_name)
+                    if width > natural_width[index]:
+                        natural_width[index] = width
+        max_width = max(table_width * MAX_COLUMN_RATIO, MIN_COLUMN_WIDTH)
+        column_width = [min(max(width + CELL_PADDING, MIN_COLUMN_WIDTH), max_width) for width in natural_width]
+
+        key_columns = list(range(min(repeat_columns, column_len)))
+        bands = [list(range(column_len))]
+        if sum(column_width) > table_width:
+            key_width = sum(column_width[index] for index in key_columns)
+            bands, band, band_width = [], list(key_columns), key_width
+            for index in range(len(key_columns), column_len):
+                if band_width + column_width[index] > table_width and len(band) > len(key_columns):
+                    bands.append(band)
+                    band, band_width = list(key_columns), key_width
+                band.append(index)
+                band_width += column_width[index]
+            bands.append(band)
+
+        column_bands = []
+        for band in bands:
+            scale = table_width / (sum(column_width[index] for index in band) or 1)
+            column_bands.append((band, [column_width[index] * scale for index in band]))
+        return column_bands
+
+    @staticmethod
+    def _band_merges(merge_ranges: MergedRanges, columns: List[int]):
+        """
+        把合并单元格的区域转换为列分组中的区域
+
+        区域的列是列分组中的索引，超出列分组的部分会被去掉；左上角的单元格不在列分组中时，
+        使用列分组中的第一个单元格显示合并区域的值
+        Args:
+            merge_ranges: 合并单元格区域的索引，行列从1开始
+            columns: 列分组中的列的索引，从0开始
+        Returns:
+            ([(start_row, start_column, end_row, end_column)]按起始行排序, {行号: 被合并的列}, {行号: {列: 值所在的列}})
+        """
+        spans, anchors = [], {}
+        for start_row, start_column, end_row, end_column in merge_ranges:
+            band_columns = [pos for pos, index in enumerate(columns) if start_column - 1 <= index <= end_column - 1]
+            if not band_columns:
+                continue
+            spans.append((start_row, band_columns[0], end_row, band_columns[-1]))
+            anchors.setdefault(start_row, {})[band_columns[0]] = start_column - 1
+        spans.sort()
+        covered = MergedRanges(spans, min_index=0).covered_cells
+        return spans, covered, anchors
+
+    @staticmethod
+    def _span_commands(spans: List[Tuple[int, int, int, int]], body_rows: List[int]) -> List[tuple]:
+        """
+        生成一页表格中合并单元格的SPAN命令，合并的区域居中显示
+        Args:
+            spans: 列分组中合并单元格的区域，按起始行排序
+            body_rows: 这一页表格中表体的行号，是连续的
+        Returns:
+
+        """
+        if not spans:
+            return []
+        first = body_rows[0] if body_rows else 2
+        last = body_rows[-1] if body_rows else 1
+        # 和这一页相交的区域的起始行在表头或者[first - 最大的行数, last]之间
+        tallest = max(end_row - start_row for start_row, _, end_row, _ in spans)
+        lower, upper = bisect_left(spans, (max(first - tallest, 2),)), bisect_right(spans, (last, float("inf")))
+        candidates = chain(spans[:bisect_right(spans, (1, float("inf")))], spans[lower:upper])
+        commands = []
+        for start_row, start_column, end_row, end_column in candidates:
+            local_rows = [0] if start_row == 1 else []
+            top, bottom = max(start_row, first), min(end_row, last)
+            if top <= bottom:
+                local_rows.extend((top - first + 1, bottom - first + 1))
+            if not local_rows:
+                continue
+            top, bottom = min(local_rows), max(local_rows)
+            if top != bottom or start_column != end_column:
+                commands.append(('SPAN', (start_column, top), (end_column, bottom)))
+        return commands
+
+    @staticmethod
+    def _parse_cell(one_value):
+        """
+        解析单元格的值和样式，和ExcelWriter中字典单元格的格式一致
+        Args:
+            one_value: 单元格的值，字典时可以包含value、color、horizontal、vertical
+        Returns:
+            (cell_value, cell_color, cell_horizontal, cell_vertical)
+        """
+        if not isinstance(one_value, dict):
+            return one_value, None, None, None
+        cell_color = one_value.get("color", None)
+        if cell_color:
+            cell_color = f"#{cell_color.lstrip('# ')}"
+        cell_horizontal = _HORIZONTAL_ALIGN.get(one_value.get("horizontal", None))
+        cell_vertical = _VERTICAL_ALIGN.get(one_value.get("vertical", None))
+        return one_value.get("value"), cell_color or None, cell_horizontal, cell_vertical
+
+    def _table_cells(self, row, columns, column_width, style, covered=(), anchors=None):
+        """
+        生成一行的单元格
+
+        一行能放下的纯文本直接作为字符串由表格绘制，只有需要换行或者有标签的单元格才使用Paragraph；
+        被合并的单元格为空，合并区域的单元格默认居中
+        Args:
+            row: 行数据
+            columns: 列的索引
+            column_width: 每列的宽度
+            style: 单元格的段落样式
+            covered: 被合并的单元格在列分组中的索引
+            anchors: 合并区域左上角的单元格，{列分组中的索引: 值所在的列}
+        Returns:
+            (单元格, 每个单元格的样式)，所有单元格都使用默认样式时样式为None
+        """
+        cells, styles = [], []
+        font_name = self.font_name
+        for pos, (index, width) in enumerate(zip(columns, column_width)):
+            if pos in covered:
+                cells.append("")
+                styles.append(None)
+                continue
+            anchor = anchors is not None and pos in anchors
+            one_value, cell_color, cell_horizontal, cell_vertical = self._parse_cell(
+                row[anchors[pos]] if anchor else row[index])
+            if anchor:
+                cell_horizontal, cell_vertical = cell_horizontal or "CENTER", cell_vertical or "MIDDLE"
+            text = str(one_value) if one_value else ""
+            if not text or (_PLAIN_TEXT_RE.fullmatch(text) and
+                            string_width(text, font_name) <= width - CELL_PADDING):
+                cells.append(text)
+            elif cell_horizontal is None:
+                cells.append(_CachedParagraph(text, style))
+            else:
+                cells.append(_CachedParagraph(text, self.get_style("Normal", _PARAGRAPH_ALIGNMENT[cell_horizontal])))
+            styles.append((cell_color, cell_horizontal, cell_vertical)
+                          if cell_color or cell_horizontal or cell_vertical else None)
+        return cells, (styles if any(styles) else None)
 
     @staticmethod
     def on_pages_setup(canvas, doc):
         """
         为每页增加水印，或者其他的logo等
+
+        水印在每个文档中只绘制一次，保存为form XObject，每页只引用这个对象
         Args:
 
         Returns:
 
         """
-        canvas.saveState()
+        water_mark, water_mark_image = doc.water_mark, getattr(doc, "water_mark_image", None)
+        if not water_mark and not water_mark_image:
+            return
+        if not canvas.hasForm(WATER_MARK_FORM):
+            canvas.beginForm(WATER_MARK_FORM)
+            canvas.saveState()
+            canvas.rotate(30)  # 旋转30度
+            canvas.setFillAlpha(0.1)  # 设置透明度
+            if water_mark_image:
+                width, height = 4 * inch, 3 * inch
+                canvas.drawImage(ImageReader(water_mark_image), 6.5 * inch - width / 2, 3.75 * inch - height / 2,
+                                 width, height, mask="auto", preserveAspectRatio=True, anchor="c")
+            if water_mark:
+                canvas.setFont(doc.font_name, 60)
+                canvas.setFillGray(0.50)  # 设置灰度
+                canvas.drawCentredString(6.5 * inch, 3.75 * inch, water_mark)
+            canvas.restoreState()
+            canvas.endForm()
+        canvas.doForm(WATER_MARK_FORM)
+
+    def _start_build(self, ):
+        """
+        开始增量排版，和SimpleDocTemplate.build一样设置页面模板并创建canvas
+        Args:
+        Returns:
+
+        """
+        document = self.document
+        document._calc()
+        frame = Frame(document.leftMargin, document.bottomMargin, document.width, document.height, id='normal')
+        document.addPageTemplates([
+            PageTemplate(id='First', frames=frame, pagesize=document.pagesize,
+                         onPage=self.on_pages_setup if self.water_mark_first_page else _no_water_mark),
+            PageTemplate(id='Later', frames=frame, pagesize=document.pagesize,
+                         onPage=self.on_pages_setup if self.water_mark_later_pages else _no_water_mark)])
+        document._startBuild()
+        document.canv._doctemplate = document
+        self._building = True
 
-        canvas.setFont("simhei", 60)
-        canvas.rotate(30)  # 旋转30度
-        canvas.setFillAlpha(0.1)  # 设置透明度
-        canvas.setFillGray(0.50)  # 设置灰度
-        canvas.drawCentredString(6.5 * inch, 3.75 * inch, doc.water_mark)
+    def _flush_story(self, ):
+        """
+        增量模式下把story中的内容逐个排版到页面上，排版后的内容从story中移除
+        Args:
+        Returns:
 
-        canvas.restoreState()
+        """
+        if not self.incremental:
+            return
+        if not self._building:
+            self._start_build()
+        document = self.document
+        while self.story:
+            document.clean_hanging()
+            # handle_flowable会从列表中取出内容，放不下时把拆分后剩余的部分放回列表
+            document.handle_flowable(self.story)
 
     def save(self, ):
         """
@@ -277,4 +1027,16 @@ class PDFWriter(object):
         Returns:
 
         """
-        self.document.build(self.story, onLaterPages=self.on_pages_setup)
+        # 保存后没有再添加内容时不重复保存，with语句中已经调用过save时退出不会报错，也不会用空的文档覆盖
+        if self._saved and not self._building and not self.story:
+            return
+        if self.incremental:
+            self._flush_story()
+            del self.document.canv._doctemplate
+            self.document._endBuild()
+            self._building = False
+        else:
+            self.document.build(self.story,
+                                onFirstPage=self.on_pages_setup if self.water_mark_first_page else _no_water_mark,
+                                onLaterPages=self.on_pages_setup if self.water_mark_later_pages else _no_water_mark)
+        self._saved = True
@@ -6,22 +6,100 @@
 @software: PyCharm
 @time: 19-2-11 下午6:14
 """
-from itertools import zip_longest
-from typing import Any, List, MutableSequence, Optional, Tuple, Union
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from copy import deepcopy
+from functools import lru_cache
+from io import BytesIO
+from itertools import chain, zip_longest
+from typing import (Any, BinaryIO, Dict, Iterable, Iterator, List, MutableSequence, NamedTuple, Optional, Sequence,
+                    Tuple, Union)
+from xml.sax.saxutils import escape
 
 from docx import Document, document, table
-from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT, WD_ROW_HEIGHT_RULE, WD_TABLE_ALIGNMENT
+from docx.enum.table import WD_TABLE_ALIGNMENT
+from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+# noinspection PyProtectedMember
+from docx.image.image import BaseImageHeader, Image, _ImageHeaderFactory
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
 from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.xmlchemy import BaseOxmlElement
+from docx.opc.package import OpcPackage
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+# noinspection PyProtectedMember
+from docx.opc.pkgwriter import _ContentTypesItem
 from docx.oxml.ns import nsdecls, qn
-from docx.shared import Inches, Pt, RGBColor
+from docx.oxml.shape import CT_Inline
+from docx.shared import Inches, Pt
 # noinspection PyProtectedMember
 from docx.table import _Cell, _Row
 from docx.text.run import Run
+from lxml import etree
 from path import Path
 
+from .utils import MergedRanges, RowNormalizer, iter_rows, split_frame
+
 __all__ = ("WordWriter", "ValueAttr")
 
+DEFAULT_TEMPLATE_PATH = Path(__file__).dirname().joinpath("templates/template.docx").abspath()
+
+# 解析后的模板，{模板文件路径: (修改时间, 模板的包)}
+_templates: Dict[str, Tuple[int, OpcPackage]] = {}
+_template_lock = threading.Lock()
+
+# 图片头部解析的结果，{图片内容的sha1: 图片头部}
+_image_headers: Dict[str, BaseImageHeader] = {}
+_IMAGE_HEADERS_SIZE = 1024
+
+# 拼接为XML的行或段落每批的数量，每一批只解析一次
+_XML_BATCH_SIZE = 1000
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    """
+    把items按数量分批
+    Args:
+        items: 需要分批的元素
+        size: 每批的数量
+    Returns:
+        每批元素组成的列表
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _new_document(template_path: str = DEFAULT_TEMPLATE_PATH) -> document.Document:
+    """
+    根据模板创建新的文档
+
+    每个模板在每个进程中只解压和解析一次，新的文档深拷贝解析后的包，模板文件的修改时间变化时重新解析
+    Args:
+        template_path: 模板文件路径
+    Returns:
+
+    """
+    template_path = str(Path(template_path).abspath())
+    mtime = os.stat(template_path).st_mtime_ns
+    with _template_lock:
+        cached = _templates.get(template_path)
+        if cached is None or cached[0] != mtime:
+            cached = _templates[template_path] = (mtime, Document(template_path).part.package)
+        # lxml的文档不能在多个线程中同时使用，拷贝也在锁中进行
+        package: OpcPackage = deepcopy(cached[1])
+    return package.main_document_part.document
+
 
 class ValueAttr(object):
     """
@@ -51,22 +129,286 @@ class ValueAttr(object):
         self.is_bold: bool = is_bold
 
 
+# ValueAttr的水平对齐方式对应的w:jc的值
+_JC_VALUES = {WD_TABLE_ALIGNMENT.LEFT: "left", WD_TABLE_ALIGNMENT.CENTER: "center", WD_TABLE_ALIGNMENT.RIGHT: "right"}
+# 段落中加粗标红的文本的run属性
+_HIGHLIGHT_RPR = '<w:rPr><w:b/><w:color w:val="FF0000"/><w:sz w:val="24"/></w:rPr>'
+
+
+class _CellFormat(NamedTuple):
+    """
+    单元格的格式，run属性、段落属性和背景颜色的XML片段
+    """
+    rpr_xml: str
+    ppr_xml: str
+    shd_xml: str
+
+
+@lru_cache(maxsize=4096)
+def _cell_format(fontsize: float, is_bold: bool = False, bgcolor: Optional[str] = None,
+                 halignment: Optional[WD_TABLE_ALIGNMENT] = WD_TABLE_ALIGNMENT.CENTER) -> _CellFormat:
+    """
+    获取单元格的格式，相同的字号、加粗、背景颜色和水平对齐方式只生成一次
+    Args:
+        fontsize: 字号大小
+        is_bold: 是否加粗
+        bgcolor: 背景颜色
+        halignment: 水平对齐方式，为空时不设置
+    Returns:
+
+    """
+    # 因为样式中的字号无效，只能手动设置字号
+    rpr_xml = f'<w:rPr>{"<w:b/>" if is_bold else ""}<w:sz w:val="{int(Pt(fontsize).pt * 2)}"/></w:rPr>'
+    ppr_xml = f'<w:pPr><w:jc w:val="{_JC_VALUES.get(halignment, "center")}"/></w:pPr>' if halignment else ""
+    shd_xml = f'<w:shd w:fill="{escape(bgcolor, {chr(34): "&quot;"})}"/>' if bgcolor else ""
+    return _CellFormat(rpr_xml, ppr_xml, shd_xml)
+
+
+def _run_text_xml(text: str) -> str:
+    """
+    生成run中文本的XML，和python-docx的Run.text一致，制表符和换行符转换为w:tab和w:br
+    Args:
+        text: 文本
+    Returns:
+
+    """
+    if "\t" not in text and "\n" not in text and "\r" not in text:
+        if not text:
+            return ""
+        if len(text.strip()) < len(text):
+            return f'<w:t xml:space="preserve">{escape(text)}</w:t>'
+        return f"<w:t>{escape(text)}</w:t>"
+    parts, start = [], 0
+    for index, char in enumerate(text):
+        if char in "\t\r\n":
+            parts.append(_run_text_xml(text[start:index]))
+            parts.append("<w:tab/>" if char == "\t" else "<w:br/>")
+            start = index + 1
+    parts.append(_run_text_xml(text[start:]))
+    return "".join(parts)
+
+
+@lru_cache(maxsize=1024)
+def _shd_element(rgbcolor: str) -> BaseOxmlElement:
+    """
+    获取背景颜色的w:shd元素，只能深拷贝后使用
+    Args:
+        rgbcolor: RGB颜色
+    Returns:
+
+    """
+    return parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), rgbcolor))
+
+
+class _TableRowsBuilder(object):
+    """
+    批量生成表格的行
+
+    python-docx每次获取row.cells都会重新计算整行的单元格，逐个设置单元格的属性也需要多次查找和创建元素。
+    这里把每行直接拼接为XML文本，字号、对齐方式和单元格宽度的片段只生成一次，每一批行只解析一次后追加到表格中，
+    合并单元格生成gridSpan和vMerge，结果和逐个单元格设置的一致
+    """
+    batch_rows = _XML_BATCH_SIZE
+
+    def __init__(self, table_: table.Table, merge_ranges: MergedRanges, fontsize: float):
+        """
+            批量生成表格的行
+        Args:
+            table_: 没有行的表格，列宽从表格的tblGrid中获取
+            merge_ranges: 合并单元格区域的索引，行列从0开始
+            fontsize: 字号大小
+        """
+        # noinspection PyProtectedMember
+        self.tbl = table_._tbl
+        self.widths = [int(grid_col.get(qn("w:w"))) for grid_col in self.tbl.tblGrid.gridCol_lst]
+        self.fontsize = fontsize
+        cell_format = _cell_format(fontsize)
+        self.cell_open = [f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/><w:vAlign w:val="center"/></w:tcPr>'
+                          f'<w:p>{cell_format.ppr_xml}<w:r>{cell_format.rpr_xml}' for width in self.widths]
+        self.empty_cell = [f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr><w:p/></w:tc>'
+                           for width in self.widths]
+        # {行索引: {起始列: 合并区域}}，合并区域经过的每一行都有记录
+        self.spans: Dict[int, Dict[int, Tuple[int, int, int, int]]] = {}
+        for merge_range in merge_ranges:
+            for row_index in range(merge_range[0], merge_range[2] + 1):
+                self.spans.setdefault(row_index, {})[merge_range[1]] = merge_range
+        self.anchors: Dict[Tuple[int, int], list] = {}  # {(起始行, 起始列): [tcPr的开头, 单元格的值]}
+        self.open_until = -1  # 还没有结束的合并区域的最大行索引
+        self.rows: List[list] = []
+
+    def _value_xml(self, cell_value: Union[ValueAttr, Any]) -> Tuple[str, str, str]:
+        """
+        生成一个值的run
+        Args:
+            cell_value: 单元格值
+        Returns:
+            (run, 段落的属性, 背景颜色)
+        """
+        if isinstance(cell_value, ValueAttr):
+            cell_format = _cell_format(self.fontsize, bool(cell_value.is_bold), cell_value.bgcolor or None,
+                                       cell_value.halignment or None)
+            text = str(cell_value.value)
+        else:
+            cell_format, text = _cell_format(self.fontsize), str(cell_value)
+        return f"<w:r>{cell_format.rpr_xml}{_run_text_xml(text)}</w:r>", cell_format.ppr_xml, cell_format.shd_xml
+
+    def _cell_xml(self, tc_head: str, values: list) -> str:
+        """
+        生成单元格，多个值依次添加到同一个段落中，对齐方式和背景颜色以最后设置的为准
+        Args:
+            tc_head: tcPr中宽度和合并的属性
+            values: 单元格的值
+        Returns:
+
+        """
+        if not values:
+            return f"<w:tc><w:tcPr>{tc_head}</w:tcPr><w:p/></w:tc>"
+        runs, ppr, shd = [], "", ""
+        for cell_value in values:
+            run, value_ppr, value_shd = self._value_xml(cell_value)
+            runs.append(run)
+            ppr, shd = value_ppr or ppr, value_shd or shd
+        return (f'<w:tc><w:tcPr>{tc_head}{shd}<w:vAlign w:val="center"/></w:tcPr>'
+                f'<w:p>{ppr}{"".join(runs)}</w:p></w:tc>')
+
+    def add_row(self, row_index: int, row_data: Sequence[Union[ValueAttr, str]], height_rule: bool = True):
+        """
+        添加一行，被合并的单元格中的空字符串不再写入，其他的值添加到合并区域左上角的单元格中
+        Args:
+            row_index: 行索引
+            row_data: 行数据
+            height_rule: 是否设置自动行高
+        Returns:
+
+        """
+        column_len = len(self.widths)
+        if len(row_data) > column_len:
+            raise ValueError(f"table data值错误,第{row_index + 1}行的长度超过了表格的列数{column_len}")
+        parts: list = ['<w:tr><w:trPr><w:trHeight w:hRule="auto"/></w:trPr>' if height_rule else "<w:tr>"]
+        spans = self.spans.get(row_index)
+        if spans is None:
+            cell_open = self.cell_open
+            for col_index, cell_value in enumerate(row_data):
+                if isinstance(cell_value, str):
+                    parts.append(f"{cell_open[col_index]}{_run_text_xml(cell_value)}</w:r></w:p></w:tc>")
+                else:
+                    parts.append(self._cell_xml(f'<w:tcW w:type="dxa" w:w="{self.widths[col_index]}"/>',
+                                                [cell_value]))
+            parts.extend(self.empty_cell[len(row_data):])
+        else:
+            col_index = 0
+            while col_index < column_len:
+                merge_range = spans.get(col_index)
+                if merge_range is None:
+                    parts.append(self._cell_xml(f'<w:tcW w:type="dxa" w:w="{self.widths[col_index]}"/>',
+                                                list(row_data[col_index:col_index + 1])))
+                    col_index += 1
+                    continue
+                start_row, start_col, end_row, end_col = merge_range
+                covered = [val for val in row_data[start_col:end_col + 1] if not (isinstance(val, str) and not val)]
+                tc_head = f'<w:tcW w:type="dxa" w:w="{sum(self.widths[start_col:end_col + 1])}"/>'
+                if end_col > start_col:
+                    tc_head += f'<w:gridSpan w:val="{end_col - start_col + 1}"/>'
+                if row_index == start_row:
+                    if end_row > start_row:
+                        tc_head += '<w:vMerge w:val="restart"/>'
+                        self.open_until = max(self.open_until, end_row)
+                    anchor = self.anchors[(start_row, start_col)] = [tc_head, []]
+                    parts.append(anchor)
+                else:
+                    parts.append(f"<w:tc><w:tcPr>{tc_head}<w:vMerge/></w:tcPr><w:p/></w:tc>")
+                    anchor = self.anchors[(start_row, start_col)]
+                # 合并区域中只有空字符串时也写入一个空值，和逐个单元格添加一样设置字号和对齐方式
+                if not covered and not anchor[1] and row_data[start_col:end_col + 1]:
+                    covered = [""]
+                anchor[1].extend(covered)
+                col_index = end_col + 1
+        parts.append("</w:tr>")
+        self.rows.append(parts)
+        # 合并区域左上角的单元格在区域结束后才能确定，这之前不能生成XML
+        if len(self.rows) >= self.batch_rows and row_index >= self.open_until:
+            self.flush()
+
+    def flush(self, ):
+        """
+        把已经添加的行解析后追加到表格中
+        Returns:
+
+        """
+        if not self.rows:
+            return
+        xml = "".join(part if isinstance(part, str) else self._cell_xml(*part)
+                      for parts in self.rows for part in parts)
+        self.tbl.extend(list(parse_xml(f"<w:tbl {nsdecls('w')}>{xml}</w:tbl>")))
+        self.rows = []
+        self.anchors = {}
+
+
+def _image_buffer(image: Union[str, bytes, bytearray, memoryview, BinaryIO]) -> Tuple[Union[bytes, memoryview],
+                                                                                       Optional[str]]:
+    """
+    获取图片的内容，bytes、bytearray、memoryview和BytesIO不会拷贝
+    Args:
+        image: 图片的路径、bytes、memoryview或者文件对象
+    Returns:
+        (图片的内容, 文件名)
+    """
+    if isinstance(image, bytes):
+        return image, None
+    if isinstance(image, (bytearray, memoryview)):
+        return memoryview(image).cast("B"), None
+    if isinstance(image, BytesIO):
+        return image.getbuffer(), None
+    if hasattr(image, "read"):
+        return image.read(), None
+    with open(image, "rb") as image_file:
+        return image_file.read(), os.path.basename(image)
+
+
+def _image_header(sha1: str, blob: bytes) -> BaseImageHeader:
+    """
+    获取图片的头部信息，包括类型、像素和dpi，相同内容的图片只解析一次
+    Args:
+        sha1: 图片内容的sha1
+        blob: 图片内容
+    Returns:
+
+    """
+    image_header = _image_headers.get(sha1)
+    if image_header is None:
+        if len(_image_headers) >= _IMAGE_HEADERS_SIZE:
+            _image_headers.clear()
+        image_header = _image_headers[sha1] = _ImageHeaderFactory(BytesIO(blob))
+    return image_header
+
+
 class WordWriter(object):
     """
     word writer
     """
 
-    def __init__(self, word_name, word_path=None):
+    def __init__(self, word_name, word_path=None, template_path=None, *, streaming=False):
         """
             word writer
         Args:
             word_name: word 名称
             word_path: word path
+            template_path: 模板文件路径，默认使用自带的模板
+            streaming: 是否流式写入，添加的内容序列化到磁盘上的临时文件中并从文档中移除，保存时再组装docx，
+                内存占用只和最大的一个表格有关；这时document中只有还没有写入的内容
         """
         self.word_name = f"{word_name}.docx"
         self.word_path = word_path
-        template_path = Path(__file__).dirname().joinpath("templates/template.docx").abspath()
-        self.document: document.Document = Document(template_path)
+        self.document: document.Document = _new_document(template_path or DEFAULT_TEMPLATE_PATH)
+        # 段落样式的id，{样式名称: 样式id}
+        self._style_ids: Dict[str, Optional[str]] = {}
+        # 已经添加的图片，{图片内容的sha1: (关系id, 图片)}
+        self._images: Dict[str, Tuple[str, Image]] = {}
+        # 流式写入时document.xml中body的内容
+        self._spool = tempfile.TemporaryFile() if streaming else None
+        # 写入临时文件的内容已经不在文档中，python-docx无法根据它们计算图片等的id，这里统一重新编号
+        self._next_id = 1 + max((int(val) for val in self.document.element.xpath("//@id") if val.isdigit()),
+                                default=0)
 
     def __enter__(self):
         """
@@ -89,22 +431,8 @@ class WordWriter(object):
         self.save()
 
     # noinspection DuplicatedCode
-    @staticmethod
-    def _reduce_datetimes(row):
-        """Receives a row, converts datetimes to strings."""
-
-        row = list(row)
-
-        for i, val in enumerate(row):
-            if hasattr(val, "strftime"):
-                row[i] = val.strftime("%Y-%m-%d %H:%M:%S")
-            elif hasattr(val, 'isoformat'):
-                row[i] = val.isoformat()
-        return tuple(row)
-
-    # noinspection DuplicatedCode
-    def add_table(self, header_name: str, header_data: List[List[Union[ValueAttr, str]]],
-                  table_data: List[List[Union[ValueAttr, str]]],
+    def add_table(self, header_name: str, header_data: Iterable[Sequence[Union[ValueAttr, str]]],
+                  table_data: Iterable[Sequence[Union[ValueAttr, str]]],
                   merge_cells: List[Tuple[Tuple[int, int], Tuple[int, int]]] = None,
                   unit=None, body_fontsize=10):
         """
@@ -112,25 +440,19 @@ class WordWriter(object):
         Args:
             header_name: 表格的表头文字
             header_data: 表格的表头数据，可能有多个
-            table_data: 表格的body数据，可能有多个
+            table_data: 表格的body数据，可能有多个，可以是列表、生成器或者数据库游标，每行是列表、元祖或者字典
             merge_cells: 要合并的单元格
             unit: 表格数据的单位
             body_fontsize: body的字号大小
         Returns:
 
         """
-        if not isinstance(header_data, MutableSequence):
+        if not isinstance(header_data, Iterable):
             raise ValueError("header data值类型错误,请检查")
-        if not isinstance(table_data, MutableSequence):
+        if not isinstance(table_data, Iterable):
             raise ValueError("table data值类型错误,请检查")
-        if not isinstance(merge_cells, MutableSequence):
-            raise ValueError("merge cells值类型错误,请检查")
-        for value in header_data:
-            if not isinstance(value, MutableSequence):
-                raise ValueError("header data值类型错误,请检查")
-        for value in table_data:
-            if not isinstance(value, MutableSequence):
-                raise ValueError("table data值类型错误,请检查")
+        # 表头行数很少，这里直接生成列表，表体逐行处理
+        header_data = list(iter_rows(header_data, error_msg="header data值类型错误,请检查"))
 
         p = self.document.add_paragraph(style="p-first-line-not-indent-center")
         p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
@@ -147,39 +469,43 @@ class WordWriter(object):
         # 取倒数第一个header检查列的数量
         header_row, table_cols = len(header_data), len(header_data[-1])
         # analysis-data需要模板中指定，指定的方式要简单很多
-        table_: table.Table = self.document.add_table(header_row, table_cols, "analysis-data")
-        for value in merge_cells:
-            if not isinstance(value, MutableSequence) and len(value) != 2:
-                raise ValueError("merge cells值类型错误,请检查")
-            for row_index, col_index in value:
-                if row_index > header_row or col_index > table_cols:
-                    raise ValueError("merge cells值错误,请检查")
-
-        # 合并单元格
-        if merge_cells is not None:
-            for cell, other_cell in merge_cells:
-                table_.cell(*cell).merge(table_.cell(*other_cell))
+        merge_ranges = self._merge_ranges(merge_cells, header_row, table_cols)
+        table_: table.Table = self.document.add_table(0, table_cols, "analysis-data")
         # 设置表居中和自适应
         table_.alignment = WD_TABLE_ALIGNMENT.CENTER
         table_.autofit = True
-        # 添加表头，表头有可能有多行
-        for index, header in enumerate(header_data):
-            row = table_.rows[index]
-            row.height_rule = WD_ROW_HEIGHT_RULE.AUTO
-            for col_index, cell_value in enumerate(header):
-                self._add_cell_value(row.cells[col_index], cell_value, body_fontsize)
-        # 添加表体
-        for row_data in table_data:
-            row = table_.add_row()
-            row.height_rule = WD_ROW_HEIGHT_RULE.AUTO
-            for col_index, cell_value in enumerate(row_data):
-                self._add_cell_value(row.cells[col_index], cell_value, body_fontsize)
+        # 添加表头和表体，表头有可能有多行，合并单元格只在表头中
+        builder = _TableRowsBuilder(table_, merge_ranges, body_fontsize)
+        # 表体中的时间类型、None和Decimal转换为字符串
+        rows = iter_rows(table_data, reduce_row=RowNormalizer(reduce_none=True, reduce_decimals=True),
+                         error_msg="table data值类型错误,请检查")
+        for index, row_data in enumerate(chain(header_data, rows)):
+            builder.add_row(index, row_data)
+        builder.flush()
 
         self.document.add_paragraph()  # 增加一个空行的段落
+        self._flush_body()
+
+    def add_table_frame(self, header_name: str, frame, merge_cells: List[Tuple[Tuple[int, int], Tuple[int, int]]] = None,
+                        unit=None, body_fontsize=10):
+        """
+        为Word文档中添加列式数据的表格，列名为表头
+        Args:
+            header_name: 表格的表头文字
+            frame: 表格的数据，pandas.DataFrame、numpy结构化数组或者pyarrow.Table
+            merge_cells: 要合并的单元格
+            unit: 表格数据的单位
+            body_fontsize: body的字号大小
+        Returns:
+
+        """
+        # 按列向量化处理时间和空值，表体不需要再逐行处理
+        header, rows = split_frame(frame)
+        self.add_table(header_name, [header], rows, merge_cells=merge_cells, unit=unit, body_fontsize=body_fontsize)
 
     # noinspection DuplicatedCode
     def add_table2(self, header_name: str, rows_cols: Tuple[int, int],
-                   table_data: List[List[Union[ValueAttr, str]]],
+                   table_data: Iterable[Sequence[Union[ValueAttr, str]]],
                    merge_cells: List[Tuple[Tuple[int, int], Tuple[int, int]]] = None,
                    unit=None, body_fontsize=10):
         """
@@ -187,20 +513,15 @@ class WordWriter(object):
         Args:
             header_name: 表格的表头文字
             rows_cols: 报表的行列
-            table_data: 表格的body数据，可能有多个
+            table_data: 表格的body数据，可能有多个，可以是列表、生成器或者数据库游标，每行是列表、元祖或者字典
             merge_cells: 要合并的单元格
             unit: 表格数据的单位
             body_fontsize: body的字号大小
         Returns:
 
         """
-        if not isinstance(table_data, MutableSequence):
+        if not isinstance(table_data, Iterable):
             raise ValueError("table data值类型错误,请检查")
-        if not isinstance(merge_cells, MutableSequence):
-            raise ValueError("merge cells值类型错误,请检查")
-        for value in table_data:
-            if not isinstance(value, MutableSequence):
-                raise ValueError("table data值类型错误,请检查")
 
         p = self.document.add_paragraph(style="p-first-line-not-indent-center")
         p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
@@ -215,59 +536,51 @@ class WordWriter(object):
             unit_body.font.size = Pt(10.5)
 
         # analysis-data需要模板中指定，指定的方式要简单很多
-        table_: table.Table = self.document.add_table(*rows_cols, "analysis-data")
-        for value in merge_cells:
-            if not isinstance(value, MutableSequence) and len(value) != 2:
-                raise ValueError("merge cells值类型错误,请检查")
-            for row_index, col_index in value:
-                if row_index > rows_cols[0] or col_index > rows_cols[1]:
-                    raise ValueError("merge cells值错误,请检查")
-
-        # 合并单元格
-        if merge_cells:
-            for cell, other_cell in merge_cells:
-                table_.cell(*cell).merge(table_.cell(*other_cell))
+        merge_ranges = self._merge_ranges(merge_cells, *rows_cols)
+        table_: table.Table = self.document.add_table(0, rows_cols[1], "analysis-data")
         # 设置表居中和自适应
         table_.alignment = WD_TABLE_ALIGNMENT.CENTER
         table_.autofit = True
-        # 添加表头，添加表体
-        for index, row_data in enumerate(table_data):
-            row = table_.rows[index]
-            row.height_rule = WD_ROW_HEIGHT_RULE.AUTO
-            for col_index, cell_value in enumerate(row_data):
-                self._add_cell_value(row.cells[col_index], cell_value, body_fontsize)
+        # 添加表头，添加表体，没有数据的行保留为空行
+        builder = _TableRowsBuilder(table_, merge_ranges, body_fontsize)
+        index = -1
+        rows = iter_rows(table_data, reduce_row=RowNormalizer(reduce_none=True, reduce_decimals=True),
+                         error_msg="table data值类型错误,请检查")
+        for index, row_data in enumerate(rows):
+            if index >= rows_cols[0]:
+                raise ValueError(f"table data值错误,行数超过了表格的行数{rows_cols[0]}")
+            builder.add_row(index, row_data)
+        for index in range(index + 1, rows_cols[0]):
+            builder.add_row(index, (), height_rule=False)
+        builder.flush()
 
         self.document.add_paragraph()  # 增加一个空行的段落
+        self._flush_body()
 
-    def _add_cell_value(self, cell: _Cell, cell_value: Union[ValueAttr, str], fontsize: int):
+    @staticmethod
+    def _merge_ranges(merge_cells: Optional[Sequence[Tuple[Tuple[int, int], Tuple[int, int]]]], rows: int,
+                      cols: int) -> MergedRanges:
         """
-        添加单元格的值和样式
+        检查要合并的单元格并生成合并区域的索引
         Args:
-            cell: 表格中的单元格
-            cell_value: 单元格值
-            fontsize: 字号大小
+            merge_cells: 要合并的单元格, [((start_row, start_col), (end_row, end_col))]，最小值从0开始
+            rows: 表格的行数
+            cols: 表格的列数
         Returns:
 
         """
-        if isinstance(cell_value, ValueAttr):
-            # cell.text = str(cell_value.value)
-            # 因为样式中的字号无效，只能手动设置字号
-            cell_body = cell.paragraphs[0].add_run(str(cell_value.value))
-            cell_body.font.size = Pt(fontsize)
-            if cell_value.is_bold:
-                cell_body.font.bold = True
-
-            if cell_value.bgcolor:
-                self.set_cell_bgcolor(cell, cell_value.bgcolor)
-            if cell_value.halignment:
-                self.set_cell_halignment(cell, cell_value.halignment)  # 水平对齐
-        else:
-            # cell.text = str(cell_value)
-            # 因为样式中的字号无效，只能手动设置字号
-            cell_body = cell.paragraphs[0].add_run(str(cell_value))
-            cell_body.font.size = Pt(fontsize)
-            self.set_cell_halignment(cell, WD_TABLE_ALIGNMENT.CENTER)  # 水平居中
-        cell.vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER  # 垂直居中
+        merge_cells = [] if merge_cells is None else merge_cells
+        if not isinstance(merge_cells, MutableSequence):
+            raise ValueError("merge cells值类型错误,请检查")
+        ranges = []
+        for value in merge_cells:
+            if not isinstance(value, Sequence) or len(value) != 2 or not all(
+                    isinstance(cell, Sequence) and len(cell) == 2 for cell in value):
+                raise ValueError("merge cells值类型错误,请检查")
+            (start_row, start_col), (end_row, end_col) = value
+            ranges.append((start_row, start_col, end_row, end_col))
+        # 行列索引从0开始，最大值为行数和列数减一
+        return MergedRanges(ranges, min_index=0, max_row=rows - 1, max_column=cols - 1)
 
     @staticmethod
     def set_cell_halignment(cell: _Cell, alignment: str = WD_TABLE_ALIGNMENT.CENTER):
@@ -286,16 +599,15 @@ class WordWriter(object):
     @staticmethod
     def set_cell_bgcolor(cell: _Cell, rgbcolor: str):
         """
-        设置单元格的背景颜色
+        设置单元格的背景颜色，相同颜色的w:shd元素只解析一次
         Args:
             cell: 单元格
             rgbcolor: 要设置的RGB颜色
         Returns:
 
         """
-        bgcolor_style = parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), rgbcolor))
         # noinspection PyProtectedMember
-        cell._tc.get_or_add_tcPr().append(bgcolor_style)
+        cell._tc.get_or_add_tcPr().append(deepcopy(_shd_element(rgbcolor)))
 
     def set_row_bgcolor(self, row: _Row, rgbcolor: str):
         """
@@ -356,52 +668,138 @@ class WordWriter(object):
             other_text: 段落正文的内容
         Returns:
 
+        """
+        self.add_blocks(({"bold_text": bold_text, "other_text": other_text},))
+
+    def add_heading(self, head_text: str = None, *, level: int = 1):
+        """
+        为Word文档中添加标题
+        Args:
+            head_text: 段落标题的内容
+            level: 段落的级别， 共一到六级别
+        Returns:
+
+        """
+        self.add_blocks(({"heading": head_text, "level": level},))
+
+    def add_paragraphs(self, paragraphs: Iterable[Union[str, dict]]):
+        """
+        批量添加段落
+        Args:
+            paragraphs: 段落，每个是正文的字符串，或者是add_paragraph的参数组成的字典{"bold_text": [], "other_text": []}
+        Returns:
+
+        """
+        self.add_blocks({"other_text": [paragraph]} if isinstance(paragraph, str) else paragraph
+                        for paragraph in paragraphs)
+
+    def add_blocks(self, blocks: Iterable[Optional[dict]]):
+        """
+        批量添加标题、段落和空行
+
+        样式id只查找一次，段落直接拼接为XML，每一批只解析一次，结果和逐个调用add_heading、add_paragraph一致
+        Args:
+            blocks: 内容块，每个是字典或者None
+                {"heading": 标题, "level": 级别}: 标题，和add_heading一致，级别默认为1
+                {"bold_text": [], "other_text": []}: 段落，和add_paragraph一致
+                None或者空字典: 空行，和add_paragraph()一致
+        Returns:
+
+        """
+        for paragraphs in _batched(map(self._block_xml, blocks), _XML_BATCH_SIZE):
+            self._insert_paragraphs(paragraphs)
+        self._flush_body()
+
+    def _block_xml(self, block: Optional[dict]) -> str:
+        """
+        生成内容块的段落XML
+        Args:
+            block: 内容块，格式和add_blocks的一致
+        Returns:
+            段落的XML
+        """
+        block = block or {}
+        if "heading" in block:
+            level = block.get("level", 1)
+            if level < 1 or level > 6:
+                raise ValueError("level必须在1和6之间。")
+            text = block["heading"]
+            return self._paragraph_xml(f"heading{level}", [(text, False)] if text else [])
+        return self._paragraph_xml(*self._paragraph_runs(block.get("bold_text"), block.get("other_text")))
+
+    @staticmethod
+    def _paragraph_runs(bold_text: Optional[List[str]], other_text: Optional[List[str]]) -> Tuple[str, list]:
+        """
+        生成段落的样式和run，加粗的文本标红
+        Args:
+            bold_text: 段落开头需要加粗的文本
+            other_text: 段落正文的内容
+        Returns:
+            (样式名称, [(文本, 是否加粗)])
         """
         if not isinstance(bold_text, MutableSequence):
             bold_text = [bold_text]
         if not isinstance(other_text, MutableSequence):
             other_text = [other_text]
 
+        runs = []
         if bold_text and other_text:
-            p = self.document.add_paragraph(style="p-first-line-indent")
             for bold_text_, other_text_ in zip_longest(bold_text, other_text):
                 # 需要先添加other中的内容，因为加粗的文本前面有可能还有其他文本
                 if other_text_:
-                    p.add_run(other_text_)
+                    runs.append((other_text_, False))
                 if bold_text_:
-                    bold_run = p.add_run(bold_text_)
-                    bold_run.font.size = Pt(12)
-                    bold_run.font.bold = True
-                    bold_run.font.color.rgb = RGBColor(255, 0, 0)
+                    runs.append((bold_text_, True))
         elif bold_text and not other_text:
-            p = self.document.add_paragraph(style="p-first-line-indent")
-            bold_run = p.add_run("".join(bold_text))
-            bold_run.font.size = Pt(12)
-            bold_run.font.bold = True
-            bold_run.font.color.rgb = RGBColor(255, 0, 0)
+            runs.append(("".join(bold_text), True))
         elif not bold_text and other_text:
-            self.document.add_paragraph("".join(other_text), style="p-first-line-indent")
+            text = "".join(other_text)
+            if text:
+                runs.append((text, False))
         else:
-            self.document.add_paragraph(style="p-first-line-not-indent")
+            return "p-first-line-not-indent", runs
+        return "p-first-line-indent", runs
 
-    def add_heading(self, head_text: str = None, *, level: int = 1):
+    def _paragraph_xml(self, style_name: str, runs: List[Tuple[str, bool]]) -> str:
         """
-        为Word文档中添加标题
+        生成段落的XML
         Args:
-            head_text: 段落标题的内容
-            level: 段落的级别， 共一到六级别
+            style_name: 段落样式名称
+            runs: [(文本, 是否加粗)]
         Returns:
 
         """
-        if level < 1 or level > 6:
-            raise ValueError("level必须在1和6之间。")
-        self.document.add_paragraph(head_text, style=f"heading{level}")
+        if style_name not in self._style_ids:
+            self._style_ids[style_name] = self.document.part.get_style_id(style_name, WD_STYLE_TYPE.PARAGRAPH)
+        style_id = self._style_ids[style_name]
+        ppr = f'<w:pPr><w:pStyle w:val="{escape(style_id, {chr(34): "&quot;"})}"/></w:pPr>' if style_id else ""
+        return "<w:p>{}{}</w:p>".format(ppr, "".join(
+            f"<w:r>{_HIGHLIGHT_RPR if bold else ''}{_run_text_xml(str(text))}</w:r>" for text, bold in runs))
+
+    def _insert_paragraphs(self, paragraphs: List[str]):
+        """
+        解析段落的XML并添加到文档的末尾
+        Args:
+            paragraphs: 段落的XML
+        Returns:
+
+        """
+        if not paragraphs:
+            return
+        body = self.document.element.body
+        elements = list(parse_xml(f"<w:body {nsdecls('w')}>{''.join(paragraphs)}</w:body>"))
+        sect_pr = body.sectPr
+        if sect_pr is None:
+            body.extend(elements)
+        else:
+            for element in elements:
+                sect_pr.addprevious(element)
 
     def add_picture(self, image_path=None, image_text: str = None):
         """
         为Word文档中添加图片
         Args:
-            image_path: 图片在本地的路径
+            image_path: 图片在本地的路径，也可以是图片内容的bytes、memoryview或者文件对象
             image_text: 针对图片的说明文字
         Returns:
 
@@ -410,10 +808,107 @@ class WordWriter(object):
         p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
         run = p.add_run()
         if image_path:
-            run.add_picture(image_path, width=Inches(5.8))
+            rel_id, image = self._get_or_add_image(image_path)
+            cx, cy = image.scaled_dimensions(Inches(5.8), None)
+            # noinspection PyProtectedMember
+            run._r.add_drawing(CT_Inline.new_pic_inline(self.document.part.next_id, rel_id, image.filename, cx, cy))
         bold_run = p.add_run(f"\n{image_text}")
         bold_run.font.size = Pt(12)
         bold_run.font.bold = True
+        self._flush_body()
+
+    def _get_or_add_image(self, image: Union[str, bytes, bytearray, memoryview, BinaryIO]) -> Tuple[str, Image]:
+        """
+        获取或者添加图片
+
+        按内容的sha1缓存，相同的图片在文档中只保存一次，重复使用时只增加引用，不再读取头部和拷贝内容
+        Args:
+            image: 图片的路径、bytes、memoryview或者文件对象
+        Returns:
+            (关系id, 图片)
+        """
+        buffer, filename = _image_buffer(image)
+        sha1 = hashlib.sha1(buffer).hexdigest()
+        cached = self._images.get(sha1)
+        if cached is None:
+            part = self.document.part
+            # noinspection PyProtectedMember
+            image_parts = part.package.image_parts
+            # noinspection PyProtectedMember
+            image_part = image_parts._get_by_sha1(sha1)
+            if image_part is None:
+                # 只有第一次添加的图片才需要拷贝内容
+                blob = buffer if isinstance(buffer, bytes) else buffer.tobytes()
+                image_header = _image_header(sha1, blob)
+                # noinspection PyProtectedMember
+                image_part = image_parts._add_image_part(
+                    Image(blob, filename or f"image.{image_header.default_ext}", image_header))
+            cached = self._images[sha1] = (part.relate_to(image_part, RT.IMAGE), image_part.image)
+        return cached
+
+    def _flush_body(self, ):
+        """
+        流式写入时把body中已经添加的内容序列化到临时文件中，并从文档中移除
+        Returns:
+
+        """
+        if self._spool is None:
+            return
+        body = self.document.element.body
+        root_nsmap = self.document.element.nsmap
+        for child in list(body.iterchildren()):
+            if child.tag == qn("w:sectPr"):
+                continue
+            for id_value in child.xpath(".//@id"):
+                if id_value.isdigit() and id_value != "0":
+                    element = id_value.getparent()
+                    element.set("id", str(self._next_id))
+                    # python-docx的图片名称中也有id
+                    if element.get("name") == f"Picture {id_value}":
+                        element.set("name", f"Picture {self._next_id}")
+                    self._next_id += 1
+            xml = etree.tostring(child, encoding="utf-8")
+            # 单独序列化时会在开始标签中声明用到的命名空间，document根元素中已经声明的不再重复
+            tag_end = xml.index(b">")
+            start_tag = re.sub(rb'\sxmlns:(\w+)="([^"]*)"',
+                               lambda match: b"" if root_nsmap.get(match.group(1).decode()) == match.group(2).decode()
+                               else match.group(0), xml[:tag_end])
+            self._spool.write(start_tag)
+            self._spool.write(xml[tag_end:])
+            # 直接移除大的元素时lxml会逐个节点处理命名空间，先清空子元素要快得多
+            child.clear()
+            body.remove(child)
+
+    def _save_streaming(self, file_path):
+        """
+        组装流式写入的docx，document.xml的body内容从临时文件中复制，其他的部分和python-docx保存的一致
+        Args:
+            file_path: 文件路径
+        Returns:
+
+        """
+        self._flush_body()
+        main_part = self.document.part
+        package = main_part.package
+        parts = list(package.iter_parts())
+        # 这时body中只有sectPr，在body的开始标签之后插入临时文件中的内容
+        head, body_tag, tail = re.split(rb"(<w:body\b[^>]*>|<w:body\s*/>)", main_part.blob, 1)
+        if body_tag.endswith(b"/>"):
+            body_tag, tail = b"<w:body>", b"</w:body>" + tail
+        with zipfile.ZipFile(file_path, "w", compression=zipfile.ZIP_DEFLATED) as docx_file:
+            docx_file.writestr(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+            docx_file.writestr(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+            for part in parts:
+                if part is main_part:
+                    with docx_file.open(part.partname.membername, "w", force_zip64=True) as document_xml:
+                        document_xml.write(head + body_tag)
+                        self._spool.seek(0)
+                        shutil.copyfileobj(self._spool, document_xml)
+                        document_xml.write(tail)
+                else:
+                    docx_file.writestr(part.partname.membername, part.blob)
+                if len(part.rels):
+                    docx_file.writestr(part.partname.rels_uri.membername, part.rels.xml)
 
     def save(self, ):
         """
@@ -428,4 +923,7 @@ class WordWriter(object):
         else:
             file_path = Path(self.word_path).joinpath(self.word_name).abspath()
 
-        self.document.save(file_path)
+        if self._spool is not None:
+            self._save_streaming(file_path)
+        else:
+            self.document.save(file_path)
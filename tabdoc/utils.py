@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 26-10-18 上午10:12
+"""
+import heapq
+from bisect import bisect_right, insort
+from decimal import Decimal
+from itertools import chain
+from operator import itemgetter, methodcaller
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+__all__ = ("split_header", "iter_rows", "split_frame", "RowNormalizer", "MergedRanges")
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def iter_rows(rows: Iterable, width: Optional[int] = None, reduce_row: Callable = None,
+              error_msg: str = "table_data值数据类型错误,请检查", strict: bool = False) -> Iterator[Sequence]:
+    """
+    逐行处理表格数据，只遍历一次数据，不需要事先生成列表
+    Args:
+        rows: 行数据，可以是列表、生成器或者数据库游标，每行可以是元组、列表或者字典
+        width: 列数，行的长度小于列数时补齐空字符串
+        reduce_row: 每行数据的转换函数
+        error_msg: 行数据类型错误时的提示信息
+        strict: 行的长度大于列数时是否抛出ValueError
+    Returns:
+        处理后的行数据的迭代器
+    """
+    for row in rows:
+        if isinstance(row, Mapping):
+            row = list(row.values())
+        elif not isinstance(row, Sequence):
+            raise ValueError(error_msg)
+        # 处理list或者tuple个别长度不一致的情况
+        if width is not None and len(row) < width:
+            row = [*row, *["" for _ in range(width - len(row))]]
+        elif strict and width is not None and len(row) > width:
+            raise ValueError(f"行的列数{len(row)}大于表头的列数{width},请检查")
+        yield reduce_row(row) if reduce_row is not None else row
+
+
+def split_header(table_data: Iterable, default: List[Sequence], reduce_row: Callable = None,
+                 error_msg: str = "table_data值数据类型错误,请检查",
+                 strict: bool = False) -> Tuple[Sequence[Any], Iterator[Sequence]]:
+    """
+    从表格数据中取出表头，表体数据按需逐行处理
+
+    第一行是字典时，表头为字典的键，所有的行都是表体；否则第一行为表头，剩下的行为表体。
+    只会预读第一行数据。
+    Args:
+        table_data: 表格数据，可以是列表、生成器或者数据库游标，每行可以是元组、列表或者字典
+        default: 表格数据为空时使用的默认数据
+        reduce_row: 表体每行数据的转换函数
+        error_msg: 行数据类型错误时的提示信息
+        strict: 表体的行比表头长时是否抛出ValueError
+    Returns:
+        (表头, 表体数据的迭代器)
+    """
+    rows = iter(table_data if table_data is not None else ())
+    first = next(rows, None)
+    if first is None:
+        first, rows = default[0], iter(default[1:])
+
+    if isinstance(first, Mapping):
+        header = list(first.keys())
+        rows = chain((first,), rows)
+    elif isinstance(first, Sequence):
+        header = first
+    else:
+        raise ValueError(error_msg)
+    return header, iter_rows(rows, len(header), reduce_row, error_msg, strict)
+
+
+def split_frame(frame: Any, reduce_datetimes: bool = True) -> Tuple[List[str], Iterator[tuple]]:
+    """
+    从列式数据中取出表头和表体
+
+    支持pandas.DataFrame、numpy结构化数组和pyarrow.Table/RecordBatch，时间格式化、空值转换为空字符串等处理
+    都是按列向量化进行的，返回的行数据不需要再处理。依赖的库只在使用时才会导入。
+    Args:
+        frame: 列式数据
+        reduce_datetimes: 是否把时间类型转换为字符串
+    Returns:
+        (表头, 表体数据的迭代器)
+    """
+    module = type(frame).__module__.split(".")[0]
+    if module == "pandas":
+        header, columns = _pandas_columns(frame, reduce_datetimes)
+    elif module == "numpy" and getattr(getattr(frame, "dtype", None), "names", None):
+        header, columns = _numpy_columns(frame, reduce_datetimes)
+    elif module == "pyarrow":
+        header, columns = _arrow_columns(frame, reduce_datetimes)
+    else:
+        raise ValueError("frame值数据类型错误,必须是pandas.DataFrame、numpy结构化数组或者pyarrow.Table")
+    return header, zip(*columns)
+
+
+class _TypeConverters(dict):
+    """
+    值的类型到转换函数的映射，第一次遇到的类型才查找转换函数，不需要转换的类型对应None
+    """
+
+    def __init__(self, lookup: Callable[[type], Optional[Callable]]):
+        super().__init__()
+        self._lookup = lookup
+
+    def __missing__(self, value_type: type) -> Optional[Callable]:
+        convert = self[value_type] = self._lookup(value_type)
+        return convert
+
+
+def _decimal_text(value: Decimal) -> str:
+    """
+    Decimal转换为定点表示的字符串，不使用科学计数法
+    Args:
+        value: Decimal值
+    Returns:
+
+    """
+    return format(value, "f")
+
+
+def _empty_text(value: None) -> str:
+    """
+    None转换为空字符串
+    Args:
+        value: None
+    Returns:
+
+    """
+    return ""
+
+
+class RowNormalizer(object):
+    """
+    表体行数据的规范化，作为split_header和iter_rows的reduce_row使用
+
+    每种值的类型只查找一次转换函数(时间类型转换为字符串、None转换为空字符串、Decimal转换为定点字符串、字符串截断)，
+    前sample_rows行逐个值转换，同时记录每列出现过的类型；之后只转换出现过需要转换的类型的列，
+    其余的列只检查值的类型是否都不需要转换，都不需要转换时直接返回原来的行，出现其他类型的行再逐个值转换。
+    每个表格使用一个新的实例。
+    """
+    sample_rows = 100
+
+    def __init__(self, *, reduce_datetimes: bool = True, reduce_none: bool = False, reduce_decimals: bool = False,
+                 max_length: Optional[int] = None):
+        """
+            表体行数据的规范化
+        Args:
+            reduce_datetimes: 是否把时间类型转换为字符串
+            reduce_none: 是否把None转换为空字符串
+            reduce_decimals: 是否把Decimal转换为定点表示的字符串
+            max_length: 字符串的最大长度，超过时截断，None为不截断
+        """
+        self.reduce_datetimes = reduce_datetimes
+        self.reduce_none = reduce_none
+        self.reduce_decimals = reduce_decimals
+        self.max_length = max_length
+        self._converters = _TypeConverters(self._lookup)
+        self._plain_types: set = set()  # 不需要转换的类型
+        self._column_types: Optional[List[set]] = None
+        self._sampled = 0
+        self._width: Optional[int] = None
+        self._columns: Optional[List[int]] = None  # 需要转换的列
+        self._plain_values: Optional[Callable] = None  # 取出其余的列的值
+
+    def _lookup(self, value_type: type) -> Optional[Callable]:
+        """
+        查找类型的转换函数
+        Args:
+            value_type: 值的类型
+        Returns:
+            转换函数，不需要转换时为None
+        """
+        convert = None
+        if value_type is type(None):
+            convert = _empty_text if self.reduce_none else None
+        elif issubclass(value_type, str):
+            convert = itemgetter(slice(None, self.max_length)) if self.max_length is not None else None
+        elif issubclass(value_type, Decimal):
+            convert = _decimal_text if self.reduce_decimals else None
+        elif self.reduce_datetimes and hasattr(value_type, "strftime"):
+            convert = methodcaller("strftime", DATETIME_FORMAT)
+        elif self.reduce_datetimes and hasattr(value_type, "isoformat"):
+            convert = methodcaller("isoformat")
+        if convert is None:
+            self._plain_types.add(value_type)
+        return convert
+
+    def __call__(self, row: Sequence) -> Sequence:
+        """
+        规范化一行数据
+        Args:
+            row: 行数据
+        Returns:
+            规范化后的行数据，不需要转换时返回原来的行
+        """
+        if self._columns is None:
+            return self._sample(row)
+        if len(row) != self._width or (self._plain_values is not None and
+                                       not self._plain_types.issuperset(map(type, self._plain_values(row)))):
+            return self.convert(row)
+        if not self._columns:
+            return row
+        row, converters = list(row), self._converters
+        for index in self._columns:
+            val = row[index]
+            convert = converters[type(val)]
+            if convert is not None:
+                row[index] = convert(val)
+        return row
+
+    def convert(self, row: Sequence) -> list:
+        """
+        逐个值转换一行数据
+        Args:
+            row: 行数据
+        Returns:
+
+        """
+        return [val if convert is None else convert(val)
+                for val, convert in zip(row, map(self._converters.__getitem__, map(type, row)))]
+
+    def _sample(self, row: Sequence) -> list:
+        """
+        转换前sample_rows行并记录每列出现过的类型，然后确定需要转换的列
+        Args:
+            row: 行数据
+        Returns:
+
+        """
+        if self._column_types is None:
+            self._width, self._column_types = len(row), [set() for _ in range(len(row))]
+        if len(row) == self._width:
+            for types, val in zip(self._column_types, row):
+                types.add(type(val))
+        row = self.convert(row)
+        self._sampled += 1
+        if self._sampled >= self.sample_rows:
+            columns, plain_columns = [], []
+            for index, types in enumerate(self._column_types):
+                if any(self._converters[val] is not None for val in types):
+                    columns.append(index)
+                else:
+                    plain_columns.append(index)
+            if len(plain_columns) > 1:
+                self._plain_values = itemgetter(*plain_columns)
+            elif plain_columns:
+                # 只有一列时itemgetter返回的不是元组，改为取切片
+                self._plain_values = itemgetter(slice(plain_columns[0], plain_columns[0] + 1))
+            self._columns, self._column_types = columns, None
+        return row
+
+
+def _pandas_columns(frame, reduce_datetimes: bool) -> Tuple[List[str], List[list]]:
+    """
+    按列转换pandas.DataFrame
+    Args:
+        frame: pandas.DataFrame
+        reduce_datetimes: 是否把时间类型转换为字符串
+    Returns:
+        (表头, 每列的数据)
+    """
+    import pandas as pd
+    from pandas.api.types import infer_dtype
+
+    header, columns = [str(name) for name in frame.columns], []
+    for index in range(frame.shape[1]):
+        column = frame.iloc[:, index]
+        is_null = column.isna()
+        if column.dtype.kind == "M":
+            if reduce_datetimes:
+                column = column.dt.strftime(DATETIME_FORMAT)
+            elif column.dt.tz is not None:
+                # Excel不支持时区
+                column = column.dt.tz_localize(None)
+        elif column.dtype.kind == "m":
+            # 和行数据一样使用datetime.timedelta
+            column = pd.Series(column.to_numpy(dtype="timedelta64[us]").astype(object), index=column.index)
+        elif column.dtype.kind == "O" and reduce_datetimes and infer_dtype(column, skipna=True) in (
+                "datetime", "date", "time"):
+            column = column.map(lambda val: val.strftime(DATETIME_FORMAT), na_action="ignore")
+        if is_null.any():
+            column = column.astype(object).where(~is_null, "")
+        columns.append(column.tolist())
+    return header, columns
+
+
+def _numpy_columns(frame, reduce_datetimes: bool) -> Tuple[List[str], List[list]]:
+    """
+    按列转换numpy结构化数组
+    Args:
+        frame: numpy结构化数组
+        reduce_datetimes: 是否把时间类型转换为字符串
+    Returns:
+        (表头, 每列的数据)
+    """
+    import numpy as np
+
+    header, columns = list(frame.dtype.names), []
+    for name in header:
+        column = frame[name]
+        kind = column.dtype.kind
+        if kind == "M":
+            is_null = np.isnat(column)
+            if reduce_datetimes:
+                column = np.char.replace(np.datetime_as_string(column, unit="s"), "T", " ").astype(object)
+            else:
+                column = column.astype("datetime64[us]").astype(object)
+        elif kind == "m":
+            # 和行数据一样使用datetime.timedelta
+            is_null = np.isnat(column)
+            column = column.astype("timedelta64[us]").astype(object)
+        elif kind == "f":
+            is_null = np.isnan(column)
+            column = column.astype(object)
+        elif kind == "O":
+            is_null = np.equal(column, None)
+            column = column.copy()
+        else:
+            columns.append(column.tolist())
+            continue
+        column[is_null] = ""
+        columns.append(column.tolist())
+    return header, columns
+
+
+def _arrow_columns(frame, reduce_datetimes: bool) -> Tuple[List[str], List[list]]:
+    """
+    按列转换pyarrow.Table或者RecordBatch
+    Args:
+        frame: pyarrow.Table或者RecordBatch
+        reduce_datetimes: 是否把时间类型转换为字符串
+    Returns:
+        (表头, 每列的数据)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    header, columns = [str(name) for name in frame.schema.names], []
+    for column in frame.columns:
+        if reduce_datetimes and (pa.types.is_timestamp(column.type) or pa.types.is_date(column.type)):
+            # 精度统一到秒，否则%S会带上小数部分
+            target_type = pa.timestamp("s", getattr(column.type, "tz", None))
+            column = pc.cast(column, target_type, safe=False)
+            column = pc.strftime(column, format=DATETIME_FORMAT)
+        elif pa.types.is_duration(column.type):
+            # 纳秒精度的时长会转换为pandas.Timedelta，和行数据一样使用datetime.timedelta
+            column = pc.cast(column, pa.duration("us"))
+        elif reduce_datetimes and pa.types.is_time(column.type):
+            # 和行数据一样通过datetime.time.strftime格式化
+            columns.append(["" if val is None else val.strftime(DATETIME_FORMAT) for val in column.to_pylist()])
+            continue
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            values = pc.fill_null(column, "").to_pylist()
+        else:
+            values = column.to_pylist()
+            if column.null_count:
+                values = ["" if val is None else val for val in values]
+        columns.append(values)
+    return header, columns
+
+
+class MergedRanges(object):
+    """
+    合并单元格区域的索引
+
+    区域统一为(start_row, start_column, end_row, end_column)，起始行列不大于结束行列。创建时检查边界，
+    按行扫描检查区域之间是否重叠，复杂度为O(n log n + n·k)，k为同时跨越同一行的区域的最大数量，不超过列数；
+    被合并的单元格（不包括左上角的单元格）按行预先计算，写入数据时可以跳过这些单元格。
+    """
+
+    def __init__(self, merge_cells: Optional[Iterable[Sequence[int]]] = None, *, min_index: int = 1,
+                 max_row: Optional[int] = None, max_column: Optional[int] = None,
+                 error_msg: str = "merge cells值错误,请检查"):
+        """
+            合并单元格区域的索引
+        Args:
+            merge_cells: 要合并的单元格的索引, [(start_row, start_column, end_row, end_column)]
+            min_index: 行列索引的最小值
+            max_row: 行索引的最大值，None为不限制
+            max_column: 列索引的最大值，None为不限制
+            error_msg: 索引超出范围时的提示信息
+        """
+        self.ranges: List[Tuple[int, int, int, int]] = []
+        for value in merge_cells or ():
+            if isinstance(value, (str, bytes)) or not isinstance(value, Sequence) or len(value) != 4:
+                raise ValueError("merge cells值类型错误,请检查")
+            start_row, start_column, end_row, end_column = value
+            start_row, end_row = min(start_row, end_row), max(start_row, end_row)
+            start_column, end_column = min(start_column, end_column), max(start_column, end_column)
+            if (start_row < min_index or start_column < min_index or (max_row is not None and end_row > max_row) or
+                    (max_column is not None and end_column > max_column)):
+                raise ValueError(error_msg)
+            self.ranges.append((start_row, start_column, end_row, end_column))
+        self._check_overlaps()
+        self._covered_cells: Optional[Dict[int, FrozenSet[int]]] = None
+
+    def __iter__(self, ) -> Iterator[Tuple[int, int, int, int]]:
+        return iter(self.ranges)
+
+    def __len__(self, ) -> int:
+        return len(self.ranges)
+
+    def __bool__(self, ) -> bool:
+        return bool(self.ranges)
+
+    def __repr__(self, ) -> str:
+        return f"MergedRanges({self.ranges!r})"
+
+    def _check_overlaps(self, ):
+        """
+        检查合并区域是否重叠
+
+        按起始行排序后逐个扫描，已经结束的区域从堆中移除，仍然有效的区域的列区间互不重叠，
+        按起始列有序保存，通过二分查找判断新区域的列区间是否和它们相交
+        Returns:
+
+        """
+        active_ends: List[Tuple[int, int]] = []  # (end_row, start_column)
+        active_columns: List[Tuple[int, int, int]] = []  # (start_column, end_column, range index)
+        order = sorted(range(len(self.ranges)), key=lambda idx: self.ranges[idx])
+        for idx in order:
+            start_row, start_column, end_row, end_column = self.ranges[idx]
+            while active_ends and active_ends[0][0] < start_row:
+                _, column = heapq.heappop(active_ends)
+                del active_columns[bisect_right(active_columns, (column, float("inf"))) - 1]
+            pos = bisect_right(active_columns, (end_column, float("inf")))
+            if pos and active_columns[pos - 1][1] >= start_column:
+                other = self.ranges[active_columns[pos - 1][2]]
+                raise ValueError(f"merge cells值错误,合并区域{other}和{self.ranges[idx]}重叠")
+            insort(active_columns, (start_column, end_column, idx))
+            heapq.heappush(active_ends, (end_row, start_column))
+
+    @property
+    def covered_cells(self, ) -> Dict[int, FrozenSet[int]]:
+        """
+        被合并的单元格，{行索引: 列索引的集合}，不包括每个区域左上角的单元格
+        Returns:
+
+        """
+        if self._covered_cells is None:
+            covered: Dict[int, set] = {}
+            for start_row, start_column, end_row, end_column in self.ranges:
+                columns = range(start_column, end_column + 1)
+                covered.setdefault(start_row, set()).update(columns[1:])
+                for row in range(start_row + 1, end_row + 1):
+                    covered.setdefault(row, set()).update(columns)
+            self._covered_cells = {row: frozenset(columns) for row, columns in covered.items() if columns}
+        return self._covered_cells
+
+    @property
+    def anchors(self, ) -> FrozenSet[Tuple[int, int]]:
+        """
+        每个合并区域左上角的单元格
+        Returns:
+
+        """
+        return frozenset((val[0], val[1]) for val in self.ranges)
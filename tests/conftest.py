@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 26-10-18 下午6:10
+"""
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def table_rows():
+    """
+    表格数据，第一行是表头
+    """
+    return [('a', 'b'), ('1', 'x'), ('2', 'y'), ('3', 'z')]
+
+
+@pytest.fixture
+def row_sources(table_rows):
+    """
+    只能遍历一次的表格数据：元组的生成器、字典的生成器和数据库游标，内容都和table_rows一致
+    """
+    conn = sqlite3.connect(":memory:")
+
+    def sources():
+        yield (row for row in table_rows)
+        yield (dict(zip(table_rows[0], row)) for row in table_rows[1:])
+        values = ", ".join("(?, ?)" for _ in table_rows)
+        yield conn.execute(f"values {values}", [val for row in table_rows for val in row])
+
+    yield sources
+    conn.close()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 26-10-18 下午4:05
+"""
+import json
+import subprocess
+import sys
+
+from path import Path
+
+# import tabdoc的时间预算，只导入包本身，不加载任何writer的依赖
+IMPORT_BUDGET = 0.5
+HEAVY_MODULES = ("reportlab", "docx", "lxml", "openpyxl", "tablib")
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import tabdoc
+elapsed = time.perf_counter() - start
+loaded = sorted(name for name in {heavy!r} if name in sys.modules)
+tabdoc.ExcelWriter
+excel_loaded = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps([elapsed, loaded, excel_loaded]))
+"""
+
+
+def _run_import():
+    output = subprocess.check_output([sys.executable, "-c", _SCRIPT.format(heavy=HEAVY_MODULES)],
+                                     cwd=Path(__file__).dirname().parent)
+    return json.loads(output)
+
+
+def test_import_is_lazy():
+    elapsed, loaded, excel_loaded = _run_import()
+    assert loaded == []
+    assert elapsed < IMPORT_BUDGET
+    assert "reportlab" not in excel_loaded and "docx" not in excel_loaded
+    assert "openpyxl" in excel_loaded
+
+
+def test_lazy_attrs():
+    import tabdoc
+
+    assert {"ExcelWriter", "PDFWriter", "WordWriter", "ValueAttr"} <= set(dir(tabdoc))
+    assert tabdoc.ValueAttr.__module__ == "tabdoc.tabword"
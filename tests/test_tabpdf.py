@@ -6,7 +6,269 @@
 @software: PyCharm
 @time: 19-7-31 下午2:16
 """
-from tabdoc import PDFWriter
+from decimal import Decimal
+
+import pytest
+import reportlab
+from path import Path
+from reportlab.platypus import PageBreak
+
+from tabdoc import PDFWriter, tabpdf
+from tabdoc.tabpdf import (_CachedParagraph, _TableChunks, _load_ttfont, get_paragraph_style, register_font,
+                           register_style)
+
+# SimHei.ttf不在仓库中，测试使用reportlab自带的字体
+FONT_NAME = "vera"
+FONT_PATH = Path(reportlab.__file__).dirname().joinpath("fonts", "Vera.ttf")
+
+
+def _pdf_writer(pdf_name, pdf_path, **kwargs):
+    return PDFWriter(pdf_name, pdf_path, font_name=FONT_NAME, font_path=FONT_PATH, **kwargs)
+
+
+def test_font_cache(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("TABDOC_CACHE_DIR", str(cache_dir))
+    parsed = _load_ttfont("vera_test", FONT_PATH)
+    cache_file, = cache_dir.iterdir()
+    assert cache_file.suffix == ".marshal" and reportlab.Version in cache_file.name
+    assert (cache_dir.stat().st_mode & 0o777, cache_file.stat().st_mode & 0o777) == (0o700, 0o600)
+    loaded = []
+    monkeypatch.setattr(tabpdf.marshal, "load", lambda f, _load=tabpdf.marshal.load: loaded.append(1) or _load(f))
+    cached = _load_ttfont("vera_test", FONT_PATH)
+    assert loaded and cached.face.charWidths == parsed.face.charWidths
+    assert cached.stringWidth("中文ab", 10) == parsed.stringWidth("中文ab", 10)
+    assert cached.face.makeSubset([0, 65, 66]) == parsed.face.makeSubset([0, 65, 66])
+    # 其他用户可以写入的缓存不使用
+    cache_file.chmod(0o666)
+    loaded.clear()
+    _load_ttfont("vera_test", FONT_PATH)
+    assert not loaded
+
+
+def test_register_font_path():
+    assert register_font(FONT_NAME, FONT_PATH) == register_font(FONT_NAME) == FONT_NAME
+    with pytest.raises(ValueError):
+        register_font(FONT_NAME, Path(reportlab.__file__).dirname().joinpath("fonts", "VeraBd.ttf"))
+
+
+@pytest.fixture
+def custom_styles():
+    """
+    测试中注册的全局样式，测试结束后删除
+    """
+    names = ("test-style", "test-child")
+    yield names
+    with tabpdf._style_lock:
+        for name in names:
+            tabpdf._custom_styles.pop(name, None)
+        tabpdf._paragraph_styles.clear()
+
+
+def test_paragraph_styles_shared(custom_styles):
+    style = get_paragraph_style("Heading1", 1)
+    assert style is get_paragraph_style("Heading1", 1)
+    assert (style.alignment, style.fontName) == (1, "simhei")
+    with pytest.raises(AttributeError):
+        style.alignment = 0
+    assert style.clone("custom", alignment=2).alignment == 2
+    name, child = custom_styles
+    register_style(name, fontSize=20)
+    register_style(child, parent=name, textColor="red")
+    assert get_paragraph_style(name).fontSize == get_paragraph_style(name, 1).fontSize == 20
+    assert get_paragraph_style(child, 2).fontSize == 20
+    # 重新注册后，其他对齐方式和继承它的样式也使用新的属性
+    register_style(name, fontSize=30)
+    assert get_paragraph_style(name).fontSize == get_paragraph_style(name, 1).fontSize == 30
+    assert get_paragraph_style(child, 2).fontSize == 30
+
+
+def test_table_plain_cells(tmp_path):
+    pdf = _pdf_writer("test_cells", tmp_path)
+    pdf.add_table([['a', 'b', 'c'], [1, '中文' * 100, 'x<b>y</b>'], [None, 'b c', 2.5]])
+    table, = pdf.story[-1].split(500, 1000)
+    header, first, second = table._cellvalues
+    assert header == ['a', 'b', 'c'] and second == ['', 'b c', '2.5']
+    assert [type(cell[0] if isinstance(cell, tuple) else cell) for cell in first] == [
+        str, _CachedParagraph, _CachedParagraph]
+
+
+def test_cached_paragraph_rewrap(monkeypatch):
+    monkeypatch.setattr(tabpdf, "_WRAP_CACHE_SIZE", 2)
+    style = get_paragraph_style("Normal", font_name=register_font(FONT_NAME, FONT_PATH))
+    text = "a b c " * 20
+    first = _CachedParagraph(text, style)
+    first.wrap(100, 1000)
+    _CachedParagraph("x", style).wrap(100, 1000)
+    # 已经wrap过的段落在缓存清空的时候以新的宽度再次wrap，缓存的是完整的wrap结果
+    for width in (200, 300):
+        size = first.wrap(width, 1000)
+        second = _CachedParagraph(text, style)
+        assert second.wrap(width, 1000) == size
+        assert vars(second).keys() == vars(first).keys() and second.height == first.height
+
+
+def test_table_column_bands(tmp_path):
+    pdf = _pdf_writer("test_bands", tmp_path)
+    header = [f"column{index}" for index in range(40)]
+    pdf.add_table([header, *[[f"{row}-{index}" for index in range(40)] for row in range(3)]])
+    parts = pdf.story[-1].split(500, 1000)
+    tables = [parts[0], *[part.split(500, 1000)[0] for part in parts[2::2]]]
+    assert len(tables) > 1
+    assert all(table._cellvalues[0][0] == "column0" for table in tables)
+    assert sorted({cell for table in tables for cell in table._cellvalues[0]}) == sorted(header)
+    assert all(sum(table._colWidths) == pytest.approx(pdf.document.width) for table in tables)
+
+
+def test_table_chunks(tmp_path):
+    for is_landscape in (False, True):
+        pdf = _pdf_writer("test_chunks", tmp_path)
+        pdf.add_table((['a', 'b'] if index < 0 else [index, 'x'] for index in range(-1, 500)),
+                      is_landscape=is_landscape)
+        chunks, rows = pdf.story[-1], []
+        # 放不下时wrap返回读取的行需要的高度，能放下时返回表格的高度并直接绘制
+        assert chunks.wrap(500, 600)[1] > 600
+        while chunks is not None:
+            parts = chunks.split(500, 600)
+            chunks = parts[-1] if isinstance(parts[-1], _TableChunks) else None
+            assert parts[0]._cellvalues[0] == ['a', 'b']
+            rows.extend(row[0] for row in parts[0]._cellvalues[1:])
+        assert rows == [''] + [str(index) for index in range(1, 500)]
+
+        pdf = _pdf_writer("test_chunks", tmp_path)
+        pdf.add_table([['a', 'b'], [1, 'x']], is_landscape=is_landscape)
+        chunks = pdf.story[-1]
+        assert chunks.wrap(500, 600)[1] == chunks._table[1].wrap(500, 600)[1] < 600
+
+        pdf = _pdf_writer("test_chunks", tmp_path)
+        pdf.add_table([['a', 'b'], *[[index, 'x'] for index in range(500)]], is_landscape=is_landscape)
+        pdf.save()
+
+
+def test_table_from_iterators(tmp_path, table_rows, row_sources):
+    for table_data in row_sources():
+        pdf = _pdf_writer("test_iterators", tmp_path)
+        pdf.add_table(table_data)
+        table, = pdf.story[-1].split(500, 1000)
+        assert [tuple(row) for row in table._cellvalues] == table_rows
+        pdf.save()
+
+
+def test_table_frame_same_as_rows(tmp_path):
+    pd = pytest.importorskip("pandas")
+    frame = pd.DataFrame({'a': [1, 2], 'b': [Decimal("1E+2"), None], 'c': ['x', None]})
+    pdf = _pdf_writer("test_frame", tmp_path)
+    pdf.add_table([['a', 'b', 'c'], [1, Decimal("1E+2"), 'x'], [2, None, None]])
+    pdf.add_table_frame(frame)
+    rows, = pdf.story[-3].split(500, 1000)
+    frame_rows, = pdf.story[-1].split(500, 1000)
+    assert frame_rows._cellvalues == rows._cellvalues == [['a', 'b', 'c'], ['1', '100', 'x'], ['2', '', '']]
+
+
+def test_table_without_body(tmp_path):
+    for incremental in (False, True):
+        for table_data in ([], None, [['a', 'b']], (row for row in [['a', 'b']])):
+            pdf = _pdf_writer("test_without_body", tmp_path, incremental=incremental)
+            pdf.add_table(table_data, table_name="表格")
+            pdf.add_table([[f"column{index}" for index in range(40)]])
+            pdf.save()
+    pdf = _pdf_writer("test_without_body", tmp_path)
+    pdf.add_table([['a', 'b']])
+    table, = pdf.story[-1].split(500, 1000)
+    assert table._cellvalues == [['a', 'b']]
+
+
+def test_table_wider_rows(tmp_path):
+    pdf = _pdf_writer("test_wider_rows", tmp_path)
+    pdf.add_table([['a', 'b', 'c'], ['1'], ['1', '2', '3']])
+    table, = pdf.story[-1].split(500, 1000)
+    assert table._cellvalues[1:] == [['1', '', ''], ['1', '2', '3']]
+    with pytest.raises(ValueError):
+        pdf.add_table([['a', 'b'], ['1', '2', '3']])
+    for incremental in (False, True):
+        pdf = _pdf_writer("test_wider_rows", tmp_path, incremental=incremental)
+        with pytest.raises(ValueError):
+            pdf.add_table([['a', 'b'], *[['1', '2'] for _ in range(tabpdf.WIDTH_SAMPLE_ROWS)], ['1', '2', '3']])
+            pdf.save()
+
+
+def test_table_cell_styles(tmp_path):
+    pdf = _pdf_writer("test_cell_styles", tmp_path)
+    color = {'value': 'x', 'color': '#FF0000', 'horizontal': 'left'}
+    pdf.add_table([['a', 'b', 'c'], *[[color, dict(color, color='FF0000'), index] for index in range(200)]],
+                  merge_cells=[(1, 1, 1, 2), (3, 3, 5, 3)], data_align='RIGHT')
+    table = pdf.story[-1].split(500, 700)[0]
+    assert table._cellvalues[0] == ['a', '', 'c'] and [row[2] for row in table._cellvalues[2:5]] == ['1', '', '']
+    assert [cmd[:3] for cmd in table._bkgrndcmds] == [('BACKGROUND', (0, 1), (1, len(table._cellvalues) - 1))]
+    assert table._spanCmds == [('SPAN', (0, 0), (1, 0)), ('SPAN', (2, 2), (2, 4))]
+    assert len(table._cellStyles) and table._cellStyles[1][2].alignment == 'RIGHT'
+    pdf.save()
+
+
+def test_table_tall_merge(tmp_path):
+    for incremental in (False, True):
+        pdf = _pdf_writer("test_tall_merge", tmp_path, incremental=incremental)
+        pdf.add_table([['a', 'b', 'c'], *[[index, 'x', 'y'] for index in range(300)]], merge_cells=[(40, 1, 80, 2)])
+        pdf.save()
+    pdf = _pdf_writer("test_tall_merge", tmp_path)
+    pdf.add_table([['a', 'b', 'c'], *[[index, 'x', 'y'] for index in range(300)]], merge_cells=[(40, 1, 80, 2)])
+    chunks, rows, spans = pdf.story[-1], [], []
+    while chunks is not None:
+        parts = chunks.split(500, 600)
+        chunks = parts[-1] if isinstance(parts[-1], _TableChunks) else None
+        rows.extend(row[2] for row in parts[0]._cellvalues[1:])
+        spans.append((len(parts[0]._cellvalues) - 1, parts[0]._spanCmds))
+    assert rows == ['y'] * 300
+    # 合并区域在每一页的表格中截断，只包含这一页的行
+    merged = [(count, cmds) for count, cmds in spans if cmds]
+    assert len(merged) > 1 and all(cmds[0][1] == (0, 1) for _, cmds in merged)
+    assert merged[0][1][0][2] == (1, merged[0][0]) and sum(cmds[0][2][1] for _, cmds in merged) == 41
+
+
+def test_water_mark_form(tmp_path):
+    pdf = _pdf_writer("test_water_mark", tmp_path, water_mark="水印")
+    for index in range(5):
+        pdf.add_heading(f"第{index}页")
+        pdf.story.append(PageBreak())
+    pdf.save()
+    content = (tmp_path / "test_water_mark.pdf").read_bytes()
+    assert content.count(b"/Subtype /Form") == 1
+
+
+def test_incremental(tmp_path):
+    pages = []
+    for incremental in (False, True):
+        pdf = _pdf_writer(f"test_{incremental}", tmp_path, title="标题", water_mark="水印", incremental=incremental)
+        pdf.add_paragraph("段落")
+        pdf.add_table((['a', 'b'] if index < 0 else [index, 'x'] for index in range(-1, 300)), table_name="表格")
+        assert not pdf.story or not incremental
+        pdf.save()
+        pages.append((tmp_path / f"test_{incremental}.pdf").read_bytes().count(b"/Type /Page\n"))
+    assert pages[0] == pages[1] > 1
+    _pdf_writer("test_empty", tmp_path, incremental=True).save()
+    assert (tmp_path / "test_empty.pdf").exists()
+
+
+def test_save_twice(tmp_path):
+    for incremental in (False, True):
+        pdf_file = tmp_path / f"test_twice_{incremental}.pdf"
+        with _pdf_writer(f"test_twice_{incremental}", tmp_path, incremental=incremental) as pdf:
+            pdf.add_table([['a', 'b'], *[[index, 'x'] for index in range(300)]])
+            pdf.save()
+            size = pdf_file.stat().st_size
+            pdf.save()
+        assert pdf_file.stat().st_size == size
+
+        for explicit_save in (False, True):
+            pdf_file.unlink()
+            with pytest.raises(RuntimeError):
+                with _pdf_writer(f"test_twice_{incremental}", tmp_path, incremental=incremental) as pdf:
+                    pdf.add_paragraph("段落")
+                    if explicit_save:
+                        pdf.save()
+                    raise RuntimeError
+            assert pdf_file.stat().st_size > 0
+
 
 if __name__ == '__main__':
     data1 = [['基础基213中学教学班数、班额情况 ', '', '', '', '', '', '', '', '', '', '', '', ' 单位：个'],
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 26-10-18 下午3:20
+"""
+import os
+import shutil
+import zipfile
+from io import BytesIO
+from itertools import chain
+
+import pytest
+from docx import Document
+from docx.enum.table import WD_TABLE_ALIGNMENT
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.shared import Pt, RGBColor
+
+from tabdoc import ValueAttr, WordWriter
+from tabdoc.tabword import DEFAULT_TEMPLATE_PATH, _cell_format, _image_headers, _templates
+
+
+def test_template_cache(tmp_path):
+    template_path = tmp_path / "template.docx"
+    shutil.copy(DEFAULT_TEMPLATE_PATH, template_path)
+    first = WordWriter("first", tmp_path, template_path=template_path)
+    second = WordWriter("second", tmp_path, template_path=template_path)
+    first.add_paragraph(["第一个文档"])
+    assert first.document.element is not second.document.element
+    assert len(first.document.paragraphs) == len(second.document.paragraphs) + 1
+    mtime, package = _templates[str(template_path)]
+
+    WordWriter("third", tmp_path, template_path=template_path)
+    assert _templates[str(template_path)][1] is package
+    os.utime(template_path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    WordWriter("third", tmp_path, template_path=template_path)
+    assert _templates[str(template_path)][1] is not package
+
+    first.save()
+    second.save()
+    assert (tmp_path / "first.docx").exists() and (tmp_path / "second.docx").exists()
+
+
+def test_table_rows_builder(tmp_path):
+    writer = WordWriter("test_table", tmp_path)
+    writer.add_table2("表格", (4, 3), [["a", "b", ""], ["1", ValueAttr("2", "FF0000", "right", True), "3"], ["x", "5"]],
+                      merge_cells=[((1, 0), (3, 0)), ((0, 1), (0, 2))])
+    writer.add_table("表格", [["a", "b"]], ({"k": index, "v": "x\ty <&>"} for index in range(1500)))
+    writer.add_table2("表格", (4, 4), [["a", "b", "c", "d"], ["1", "2", "3", "4"], ["x", "y"], ["p", "q", "", ""]],
+                      merge_cells=[((2, 2), (3, 3))])
+    merged, rows, empty = writer.document.tables
+    assert [[cell.text for cell in row.cells] for row in merged.rows] == [
+        ["a", "b", "b"], ["1x", "2", "3"], ["1x", "5", ""], ["1x", "", ""]]
+    assert merged.cell(0, 1).paragraphs[0].alignment == WD_PARAGRAPH_ALIGNMENT.CENTER
+    assert merged.cell(1, 1).paragraphs[0].alignment == WD_PARAGRAPH_ALIGNMENT.RIGHT
+    assert merged.cell(1, 1).paragraphs[0].runs[0].font.bold and merged.cell(1, 1).vertical_alignment == 1
+    assert len(rows.rows) == 1501 and rows.cell(1500, 1).text == "x\ty <&>"
+    assert rows.cell(1, 0).paragraphs[0].runs[0].font.size == Pt(10)
+    # 只有空字符串的合并单元格也设置对齐方式
+    assert empty.cell(2, 2).paragraphs[0].alignment == WD_PARAGRAPH_ALIGNMENT.CENTER
+    writer.save()
+
+
+def test_table_from_iterators(tmp_path, table_rows, row_sources):
+    writer = WordWriter("test_iterators", tmp_path)
+    for table_data in row_sources():
+        # 字典的行包含表头，元组的第一行是表头
+        first = next(table_data)
+        rows = chain((first,), table_data) if isinstance(first, dict) else table_data
+        writer.add_table("表格", [table_rows[0]], rows)
+        assert [tuple(cell.text for cell in row.cells) for row in writer.document.tables[-1].rows] == table_rows
+    writer.save()
+
+
+def test_cell_format_cache(tmp_path):
+    writer = WordWriter("test_cell_format", tmp_path)
+    writer.add_table("表格", [["a", "b"]], [[ValueAttr("x", "FF0000", "right", True)] * 2])
+    assert _cell_format(10, True, "FF0000", WD_TABLE_ALIGNMENT.RIGHT) is _cell_format(10, True, "FF0000",
+                                                                                       WD_TABLE_ALIGNMENT.RIGHT)
+    first, second = writer.document.tables[0].rows[1].cells
+    assert first.paragraphs[0].runs[0]._r.rPr is not second.paragraphs[0].runs[0]._r.rPr
+    assert first.paragraphs[0].runs[0].font.bold and first.paragraphs[0].runs[0].font.size == Pt(10)
+    assert second.paragraphs[0].alignment == WD_PARAGRAPH_ALIGNMENT.RIGHT
+    assert second._tc.tcPr.xpath("./w:shd/@w:fill") == ["FF0000"]
+
+
+def test_streaming_same_as_default(tmp_path):
+    for streaming in (False, True):
+        with WordWriter(f"test_{streaming}", tmp_path, streaming=streaming) as writer:
+            writer.add_heading("标题")
+            writer.add_paragraph(["加粗"], other_text=["正文"])
+            writer.add_table("表格", [["a", "b"]], [[index, ValueAttr("x", "FF0000")] for index in range(3)])
+            if streaming:
+                assert len(writer.document.element.body) == 1
+    with zipfile.ZipFile(tmp_path / "test_False.docx") as default, zipfile.ZipFile(
+            tmp_path / "test_True.docx") as streamed:
+        assert sorted(default.namelist()) == sorted(streamed.namelist())
+        assert all(default.read(name) == streamed.read(name) for name in default.namelist())
+
+
+def test_picture_sources_deduplicated(tmp_path):
+    # 1x1的PNG图片
+    png = bytes.fromhex("89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+                        "0000000d4944415478da63f8cfc0f01f0005000201a6a0b1a30000000049454e44ae426082")
+    image_path = tmp_path / "image.png"
+    image_path.write_bytes(png)
+    writer = WordWriter("test_picture", tmp_path)
+    for image in (png, memoryview(bytearray(png)), BytesIO(png), str(image_path)):
+        writer.add_picture(image, "图片")
+    assert len(writer._images) == 1 and len(_image_headers) >= 1
+    writer.save()
+    with zipfile.ZipFile(tmp_path / "test_picture.docx") as docx_file:
+        assert [name for name in docx_file.namelist() if name.startswith("word/media/")] == ["word/media/image1.png"]
+    assert len(Document(tmp_path / "test_picture.docx").inline_shapes) == 4
+
+
+def test_add_blocks_same_as_calls(tmp_path):
+    # 用python-docx逐个添加的段落作为基准
+    expected = WordWriter("test_expected", tmp_path)
+    document = expected.document
+    document.add_paragraph("标题", style="heading2")
+    p = document.add_paragraph(style="p-first-line-indent")
+    for text, bold in (("正文1", False), ("加粗1", True), ("加粗2", True)):
+        run = p.add_run(text)
+        if bold:
+            run.font.size = Pt(12)
+            run.font.bold = True
+            run.font.color.rgb = RGBColor(255, 0, 0)
+    run = document.add_paragraph(style="p-first-line-indent").add_run("加粗3加粗4")
+    run.font.size = Pt(12)
+    run.font.bold = True
+    run.font.color.rgb = RGBColor(255, 0, 0)
+    document.add_paragraph(style="p-first-line-indent")
+    document.add_paragraph("正文2", style="p-first-line-indent")
+    document.add_paragraph(style="p-first-line-not-indent")
+    document.add_paragraph(style="heading1")
+
+    writer = WordWriter("test_calls", tmp_path)
+    writer.add_heading("标题", level=2)
+    writer.add_paragraph(["加粗1", "加粗2"], other_text=["正文1"])
+    writer.add_paragraph(["加粗3", "加粗4"], other_text=[])
+    writer.add_paragraph()
+    writer.add_paragraph([], other_text=["正文2"])
+    writer.add_paragraph([], other_text=[])
+    writer.add_heading()
+    assert writer.document.element.body.xml == document.element.body.xml
+
+    blocks = WordWriter("test_blocks", tmp_path)
+    blocks.add_blocks([{"heading": "标题", "level": 2}, {"bold_text": ["加粗1", "加粗2"], "other_text": ["正文1"]},
+                       {"bold_text": ["加粗3", "加粗4"], "other_text": []}, None])
+    blocks.add_paragraphs(["正文2", {"bold_text": [], "other_text": []}])
+    blocks.add_blocks([{"heading": None}])
+    assert blocks.document.element.body.xml == document.element.body.xml
+    with pytest.raises(ValueError):
+        blocks.add_blocks([{"heading": "标题", "level": 7}])
+
+
+def test_add_blocks_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr("tabdoc.tabword._XML_BATCH_SIZE", 2)
+    expected = WordWriter("test_expected", tmp_path)
+    for index in range(5):
+        expected.document.add_paragraph(f"正文{index}", style="p-first-line-indent")
+    writer = WordWriter("test_batches", tmp_path)
+    writer.add_paragraphs(f"正文{index}" for index in range(5))
+    assert writer.document.element.body.xml == expected.document.element.body.xml
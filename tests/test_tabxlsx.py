@@ -7,7 +7,151 @@
 @time: 19-10-9 下午3:43
 """
 
-from tabdoc import ExcelWriter
+import zipfile
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import BytesIO
+
+import openpyxl
+import pytest
+import tablib
+
+from tabdoc import ExcelStyleCache, ExcelWriter
+
+
+def _read_sheets(file_path):
+    wb = openpyxl.load_workbook(file_path)
+    return [(ws.title, ws.freeze_panes, sorted(str(val) for val in ws.merged_cells.ranges),
+             [[(cell.value, cell.font.b, cell.fill.fgColor.rgb, cell.alignment.horizontal, cell.number_format)
+               for cell in row] for row in ws.iter_rows()]) for ws in wb.worksheets]
+
+
+def test_streaming_same_as_default(tmp_path):
+    data = [['a', 'b', 'c'],
+            [1, {'value': 'x', 'color': '#FF0000', 'horizontal': 'left'}, '2'],
+            [2, '', 3]]
+    for streaming in (False, True):
+        with ExcelWriter(f"test_{streaming}", tmp_path, streaming=streaming) as xls:
+            xls.add_sheet("测试", [list(row) for row in data], merge_cells=[(2, 1, 3, 1)])
+            xls.add_sheet("测试", [{'k': 1, 'v': 2}])
+    assert _read_sheets(tmp_path / "test_False.xlsx") == _read_sheets(tmp_path / "test_True.xlsx")
+
+
+def test_native_types(tmp_path):
+    data = [['date', 'datetime', 'decimal'], [date(2024, 1, 2), datetime(2024, 1, 2, 3, 4, 5), Decimal("1.50")]]
+    for streaming in (False, True):
+        with ExcelWriter("test_native", tmp_path, streaming=streaming, native_types=True) as xls:
+            xls.add_sheet("测试", data)
+        ws = openpyxl.load_workbook(tmp_path / "test_native.xlsx").active
+        assert [(cell.value, cell.number_format) for cell in ws[2]] == [
+            (datetime(2024, 1, 2), "yyyy-mm-dd"), (datetime(2024, 1, 2, 3, 4, 5), "yyyy-mm-dd hh:mm:ss"), (1.5, "0.00")]
+
+
+def test_raw_engine_same_as_openpyxl():
+    data = [['a', 'b', 'c', 'd'],
+            [1, 2.5, {'value': 'x<&>', 'color': '#D8D8D8', 'horizontal': 'left', 'vertical': 'top'}, True],
+            [datetime(2024, 1, 2, 3, 4, 5), date(2024, 1, 2), Decimal("1.25"), None],
+            [timedelta(hours=1, seconds=30), {'value': time(1, 2, 3)}, '', '']]
+    for native_types in (False, True):
+        xls = ExcelWriter("test_raw", native_types=native_types)
+        xls.add_sheet("测试", data, merge_cells=[(2, 1, 3, 1)])
+        xls.add_sheet("测试", [{'k': 1, 'v': 2}])
+        assert (_read_sheets(BytesIO(xls.export_book(engine="raw"))) ==
+                _read_sheets(BytesIO(xls.export_book(engine="openpyxl"))))
+
+
+def test_workers_same_as_serial():
+    xls = ExcelWriter("test_workers")
+    for index in range(3):
+        xls.add_sheet("测试", [['a', 'b'], [{'value': f'x{index}', 'color': f'#D8D8D{index}'}, index], ['y', 'x0']],
+                      merge_cells=[(1, 1, 1, 2)])
+    assert (_read_sheets(BytesIO(xls.export_book(workers=2))) ==
+            _read_sheets(BytesIO(xls.export_book(engine="openpyxl"))))
+
+
+def test_workers_style_overflow(monkeypatch):
+    monkeypatch.setattr("tabdoc.tabexcel.STYLE_BLOCK_SIZE", 3)
+    xls = ExcelWriter("test_workers")
+    for index in range(3):
+        # 第二个工作表的样式超过预先分配的数量，在主进程中生成
+        colors = 1 if index != 1 else 5
+        xls.add_sheet("测试", [['a', 'b'], *[[{'value': 'x', 'color': f'#D8D8D{color}'}, index] for color in range(colors)]])
+    content = xls.export_book(workers=2)
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        assert [b't="inlineStr"' in archive.read(f"xl/worksheets/sheet{index}.xml") for index in (1, 2, 3)] == [
+            True, False, True]
+    assert _read_sheets(BytesIO(content)) == _read_sheets(BytesIO(xls.export_book(engine="openpyxl")))
+
+
+def test_style_cache():
+    cache = ExcelStyleCache(openpyxl.Workbook())
+    assert cache.get("FF0000", "left") is cache.get("FF0000", "left")
+    assert cache.get("FF0000", "left") is not cache.get("FF0000", "right")
+    xls = ExcelWriter("test_style_cache")
+    for title in ("first", "second"):
+        xls.add_sheet(title, [['a', 'b'], *[[{'value': index, 'color': '#FF0000'}, index] for index in range(500)]])
+    for engine in ("openpyxl", "raw"):
+        wb = openpyxl.load_workbook(BytesIO(xls.export_book(engine=engine)))
+        # 默认样式、表头、带背景颜色的单元格和普通单元格，两个工作表共用
+        assert len(wb._cell_styles) == 4 and len(wb._fills) == 3
+        assert {ws["A501"].fill.fgColor.rgb for ws in wb.worksheets} == {"00FF0000"}
+
+
+def test_sheet_from_iterators(table_rows, row_sources):
+    for streaming in (False, True):
+        for table_data in row_sources():
+            xls = ExcelWriter("test_iterators", streaming=streaming)
+            xls.add_sheet("测试", table_data)
+            (*_, rows), = _read_sheets(BytesIO(xls.export_book()))
+            assert [tuple(cell[0] for cell in row) for row in rows] == table_rows
+
+
+def test_sheet_wider_rows():
+    for streaming in (False, True):
+        xls = ExcelWriter("test_wider_rows", streaming=streaming)
+        xls.add_sheet("测试", [['a', 'b'], ['1']])
+        with pytest.raises(tablib.InvalidDimensions):
+            xls.add_sheet("测试", [['a', 'b'], ['1', '2'], ['1', '2', '3']])
+        with pytest.raises(tablib.InvalidDimensions):
+            xls.add_sheet("测试", [{'a': 1, 'b': 2}, {'a': 1, 'b': 2, 'c': 3}])
+        if streaming:
+            assert [len(sheet[-1]) for sheet in _read_sheets(BytesIO(xls.export_book()))] == [2, 2, 2]
+
+
+def test_sheet_frame_same_as_rows():
+    pd = pytest.importorskip("pandas")
+    frame = pd.DataFrame({'a': [1, 2], 'b': pd.to_datetime(['2024-01-02 03:04:05', None]), 'c': ['x', None]})
+    xls = ExcelWriter("test_frame")
+    xls.add_sheet("rows", [['a', 'b', 'c'], [1, datetime(2024, 1, 2, 3, 4, 5), 'x'], [2, '', '']])
+    xls.add_sheet_frame("frame", frame)
+    rows, frame_rows = _read_sheets(BytesIO(xls.export_book()))
+    assert rows[1:] == frame_rows[1:]
+
+
+def test_sheet_shards_past_max_rows():
+    for streaming in (False, True):
+        xls = ExcelWriter("test_shards", streaming=streaming)
+        xls.max_sheet_rows = 4
+        xls.add_sheet("测试", [['a', 'b'], *[[f'x{index}', index + 1] for index in range(8)]],
+                      merge_cells=[(1, 1, 1, 2), (3, 1, 6, 1)])
+        sheets = _read_sheets(BytesIO(xls.export_book()))
+        assert [title for title, *_ in sheets] == ["测试", "测试2", "测试3"]
+        assert [merged for _, _, merged, _ in sheets] == [["A1:B1", "A3:A4"], ["A1:B1", "A2:A3"], ["A1:B1"]]
+        assert [[row[1][0] for row in rows] for *_, rows in sheets] == [
+            [None, 1, 2, 3], [None, 4, 5, 6], [None, 7, 8]]
+        assert xls.merge_cells_index["测试2"] == [(1, 1, 1, 2), (2, 1, 3, 1)]
+
+
+def test_merge_cells_checked():
+    xls = ExcelWriter("test_merge")
+    for merge_cells in ([(0, 1, 1, 2)], [(1, 1, 2, 2), (2, 2, 3, 3)]):
+        with pytest.raises(ValueError):
+            xls.add_sheet("测试", [['a', 'b', 'c']], merge_cells=merge_cells)
+    merge_cells = [(2, 3, 1, 2)]
+    xls.add_sheet("测试", [['a', 'b', 'c'], ['x', 'y', 'z']], merge_cells=merge_cells)
+    assert xls.merge_cells_index["测试"] is merge_cells
+    assert _read_sheets(BytesIO(xls.export_book()))[0][2] == ["B1:C2"]
+
 
 if __name__ == '__main__':
     data1 = [['基础基213中学教学班数、班额情况 ', '', '', '', '', '', '', '', '', '', '', '', ' 单位：个'],
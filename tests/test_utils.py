@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+@author: guoyanfeng
+@software: PyCharm
+@time: 26-10-18 下午4:20
+"""
+
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import pytest
+
+from tabdoc.utils import RowNormalizer, split_frame, split_header
+
+
+def test_row_normalizer():
+    normalizer = RowNormalizer(reduce_none=True, reduce_decimals=True, max_length=3)
+    normalizer.sample_rows = 2
+    rows = [(1, datetime(2024, 1, 2, 3, 4, 5), "abcd"), (2, None, "x"), (3, date(2024, 1, 2), "y"),
+            (datetime(2024, 1, 3), Decimal("1E+2"), None), (time(1, 2), "z"), (4, 5, {"value": 1})]
+    assert [normalizer(row) for row in rows] == [
+        [1, "2024-01-02 03:04:05", "abc"], [2, "", "x"], [3, "2024-01-02 00:00:00", "y"],
+        ["2024-01-03 00:00:00", "100", ""], ["1900-01-01 01:02:00", "z"], [4, 5, {"value": 1}]]
+    # 不需要转换的列出现其他类型时也能转换
+    assert normalizer._columns == [1, 2]
+    assert normalizer((datetime(2024, 1, 3), 1, "x")) == ["2024-01-03 00:00:00", 1, "x"]
+
+
+def test_row_normalizer_defaults():
+    header, rows = split_header([["a", "b"], [None, Decimal("1.50")], [date(2024, 1, 2)]], [[""]], RowNormalizer())
+    assert (header, list(rows)) == (["a", "b"], [[None, Decimal("1.50")], ["2024-01-02 00:00:00", ""]])
+    normalizer, row = RowNormalizer(), ("x", 1)
+    normalizer.sample_rows = 1
+    assert normalizer(row) == ["x", 1] and normalizer(row) is row
+
+
+def test_frame_times_same_as_rows():
+    pd, np, pa = (pytest.importorskip(name) for name in ("pandas", "numpy", "pyarrow"))
+    times, durations = [time(1, 2, 3), None], [timedelta(hours=1, seconds=30), None]
+    for reduce_datetimes in (True, False):
+        normalizer = RowNormalizer(reduce_datetimes=reduce_datetimes, reduce_none=True)
+        expected = [list(normalizer(row)) for row in zip(times, durations)]
+        for frame in (pd.DataFrame({"t": times, "d": pd.to_timedelta(durations)}),
+                      pa.table({"t": pa.array(times, pa.time64("ns")), "d": pa.array(durations, pa.duration("ns"))})):
+            assert [list(row) for row in split_frame(frame, reduce_datetimes)[1]] == expected
+        array = np.array([(durations[0],), ("NaT",)], dtype=[("d", "m8[ns]")])
+        assert [list(row) for row in split_frame(array, reduce_datetimes)[1]] == [[durations[0]], [""]]